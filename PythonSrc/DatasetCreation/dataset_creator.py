@@ -28,7 +28,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-import glob
 import copy
 import time
 from Queue import Queue   # from 'queue' in python 3.0
@@ -36,6 +35,7 @@ import shutil
 import urllib2
 import multiprocessing
 import numpy.random as npr
+import dataset_scanner
 try:
     import hdf5_utils as HDF5
 except ImportError:
@@ -194,17 +194,10 @@ def path_from_trackid(trackid):
 def count_h5_files(basedir):
     """
     Return the number of hdf5 files contained in all
-    subdirectories of base
+    leaves (basedir/A/B/C) of base, leaves are listed
+    in parallel (see dataset_scanner)
     """
-    cnt = 0
-    try:
-        for root, dirs, files in os.walk(basedir):
-            files = glob.glob(os.path.join(root,'*.h5'))
-            cnt += len(files)
-        return cnt
-    except (IOError,OSError),e:
-        print 'ERROR:',e,'in count_h5_files, return 0'
-        return 0
+    return dataset_scanner.count_files(basedir,ext='.h5')
 
 def create_track_file(maindir,trackid,track,song,artist,mbconnect=None):
     """
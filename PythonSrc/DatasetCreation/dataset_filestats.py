@@ -6,7 +6,8 @@ This code is more of a sanitcy checks, it counts how many
 leaves there are in the filesystem for the million songs,
 thus making sure the track ID's are well-balance.
 Also try to find the most recent files, in case we have
-to delete some at the end.
+to delete some at the end, or the files modified since
+the last time we checked.
 
 This is part of the Million Song Dataset project from
 LabROSA (Columbia University) and The Echo Nest.
@@ -33,14 +34,8 @@ import os
 import sys
 import time
 import glob
-try:
-    from Queue import PriorityQueue # from queue for Python 3.0
-except ImportError:
-    from queue import PriorityQueue # Python 3.0
-
-# put in tuples likes -modifdate, fname
-# highest priority = lowest first number
-MODIFQUEUE = PriorityQueue()
+import heapq
+import dataset_scanner
 
 # list of leaves ordered by number of files
 # get filled up when we count leaves (by default)
@@ -61,37 +56,81 @@ def get_all_files(basedir,ext='.h5') :
     return allfiles
 
 
-def count_normal_leaves(basedir,revindex=True):
+def count_normal_leaves(basedir,revindex=True,nthreads=dataset_scanner.NTHREADS):
     """
     Count how many directories are of the form
     basedir/A/B/C
     If revindex, we fill up MAP_NFILES_DIR where
     the keys are number of files, and the value is
     a set of directory filenames
+    Leaves are listed by nthreads threads (see dataset_scanner)
     """
-    cnt = 0
-    for root, dirs, files in os.walk(basedir):
-        level3up = os.path.abspath(os.path.join(root,'../../..'))
-        if os.path.exists(level3up) and os.path.samefile(level3up,basedir):
-            cnt += 1
-            if revindex:
-                nfiles = len(glob.glob(os.path.join(root,'*.h5')))
-                if not nfiles in MAP_NFILES_DIR.keys():
-                    MAP_NFILES_DIR[nfiles] = set()
-                MAP_NFILES_DIR[nfiles].add(root)
-    return cnt
-
-def get_all_files_modif_date(basedir,ext='.h5'):
+    leaves = dataset_scanner.scan_leaves(basedir,ext='.h5',nthreads=nthreads)
+    if revindex:
+        for root,files in leaves.items():
+            nfiles = len(files)
+            if not nfiles in MAP_NFILES_DIR.keys():
+                MAP_NFILES_DIR[nfiles] = set()
+            MAP_NFILES_DIR[nfiles].add(root)
+    return len(leaves)
+
+def recent_files_in_leaf(leaf,k=None,since=None,ext='.h5'):
     """
-    From a root directory, look at all the file,
-    get their last modification date, put in in priority
-    queue so the most recent file pop up first
+    The k most recent files in a leaf, or all of them if k is None,
+    only files modified after 'since' if it is given.
+    Return tuples (modif date, filename), most recent first
     """
-    for root, dirs, files in os.walk(basedir):
-        files = glob.glob(os.path.join(root,'*'+ext))
-        for f in files :
-            mdate = file_modif_date(f)
-            MODIFQUEUE.put_nowait( (-mdate,f) )
+    files = [(mdate,f) for f,size,mdate in
+             dataset_scanner.list_files(leaf,ext=ext,stats=True)]
+    if since is not None:
+        files = filter(lambda x: x[0] > since,files)
+    if k is None:
+        return sorted(files,reverse=True)
+    return heapq.nlargest(k,files)
+
+
+def get_recent_files(basedir,k=None,since=None,ext='.h5',
+                     nthreads=dataset_scanner.NTHREADS):
+    """
+    From a root directory, find the k most recently modified files
+    (all files if k is None), only files modified after 'since'
+    (in seconds, as in time.time()) if it is given.
+    Leaves are scanned in parallel, each one keeps only its k most
+    recent files, so we never hold all the files in memory.
+    Return tuples (modif date, filename), most recent first
+    """
+    leaves = dataset_scanner.get_leaves(basedir,nthreads=nthreads)
+    func = lambda leaf: recent_files_in_leaf(leaf,k=k,since=since,ext=ext)
+    res = []
+    for files in dataset_scanner.thread_map(func,leaves,nthreads):
+        res.extend(files)
+        if k is not None and len(res) > k:
+            res = heapq.nlargest(k,res)
+    return sorted(res,reverse=True)
+
+
+def read_watermark(filename):
+    """
+    Time of the last scan saved in a file, None if there is no file
+    """
+    if not os.path.isfile(filename):
+        return None
+    f = open(filename,'r')
+    try:
+        return float(f.read().strip())
+    finally:
+        f.close()
+
+
+def write_watermark(filename,t):
+    """
+    Save the time of a scan in a file (see read_watermark)
+    """
+    f = open(filename,'w')
+    try:
+        f.write(repr(t)+'\n')
+    finally:
+        f.close()
 
 
 def file_modif_date(f):
@@ -107,7 +146,13 @@ def die_with_usage():
     print 'Simple util to check the file repartition and the most'
     print 'recent file in the Million Song dataset directory'
     print 'usage:'
-    print '   python dataset_filestats.py <maindir>'
+    print '   python dataset_filestats.py [FLAGS] <maindir>'
+    print 'FLAGS'
+    print '   -nthreads N  - number of threads listing the leaves'
+    print '   -k N         - number of most recent files to print (default 5)'
+    print '   -watermark F - print all files modified since the last run'
+    print '                  with the same file F (time of the run saved in F),'
+    print '                  -k is ignored then'
     sys.exit(0)
 
 
@@ -119,6 +164,9 @@ if __name__ == '__main__':
 
     trimdryrun = False
     trim = False
+    nthreads = dataset_scanner.NTHREADS
+    nrecent = 5
+    watermark = None
     while True:
         if sys.argv[1] == '-trimdryrun':
             trimdryrun = True
@@ -129,6 +177,15 @@ if __name__ == '__main__':
             else:
                 trim = True
                 print 'WE TRIM FOR REAL!!!!'
+        elif sys.argv[1] == '-nthreads':
+            nthreads = int(sys.argv[2])
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-k':
+            nrecent = int(sys.argv[2])
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-watermark':
+            watermark = sys.argv[2]
+            sys.argv.pop(1)
         else:
             break
         sys.argv.pop(1)
@@ -136,7 +193,7 @@ if __name__ == '__main__':
     maindir = sys.argv[1]
 
     # number of leaves
-    n_leaves = count_normal_leaves(maindir)
+    n_leaves = count_normal_leaves(maindir,nthreads=nthreads)
     print '******************************************************'
     print 'got',n_leaves,'leaves out of',26*26*26,'possible ones.'
 
@@ -159,21 +216,32 @@ if __name__ == '__main__':
     print 'we found',ntmpfiles,'temp files'
     if ntmpfiles > 0: print 'WATCHOUT FOR TMP FILES!!!!'
 
-    # find modif date for all files, and pop out the most recent ones
-    get_all_files_modif_date(maindir)
+    # find the most recent files
     print '******************************************************'
     if not trim and not trimdryrun:
-        print 'most recent files are:'
-        for k in range(5):
-            t,f = MODIFQUEUE.get_nowait()
-            print f,'(',time.ctime(-t),')'
+        since = None
+        if watermark is not None:
+            since = read_watermark(watermark)
+            tscan = time.time()
+        if since is None:
+            recent = get_recent_files(maindir,k=nrecent,nthreads=nthreads)
+            print 'most recent files are:'
+        else:
+            # no top-k, the watermark moves past every file we do not print
+            recent = get_recent_files(maindir,since=since,nthreads=nthreads)
+            print 'files modified since',time.ctime(since),'are:'
+        for t,f in recent:
+            print f,'(',time.ctime(t),')'
+        if watermark is not None:
+            write_watermark(watermark,tscan)
     elif trim or trimdryrun:
         ntoomany = nfiles - 1000000
         print 'we have',ntoomany,'too many files.'
-        for k in range(ntoomany):
-            t,f = MODIFQUEUE.get_nowait()
-            print f,'(',time.ctime(-t),')'
-            if trim:
-                os.remove(f)
+        if ntoomany > 0:
+            recent = get_recent_files(maindir,k=ntoomany,nthreads=nthreads)
+            for t,f in recent:
+                print f,'(',time.ctime(t),')'
+                if trim:
+                    os.remove(f)
     # done
     print '******************************************************'
@@ -62,11 +62,23 @@ def sanity_check_1thread_wrapper(args):
     """ wrapper for multiprocessing to call the real function """
     sanity_check_1thread(**args)
 
+def same_value(a,b):
+    """ True if two field values are equal, NaNs are equal too """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape != b.shape:
+        return False
+    if a.dtype.kind == 'f' and b.dtype.kind == 'f':
+        return bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+    return bool(np.all(a == b))
+
 # actual function
 def sanity_check_1thread(maindir=None,threadid=-1,nthreads=-1,allfiles=[]):
     """
-    Main function, check a bunch of files by opening every field in
-    getter.
+    Main function, check a bunch of files by reading every field
+    of every song (all getter fields, see read_song).
+    The first song of each file is also read by every getter, and
+    must agree with read_song.
     """
     assert not maindir is None,'wrong param maindir'
     assert threadid>-1,'wrong param threadid'
@@ -82,8 +94,14 @@ def sanity_check_1thread(maindir=None,threadid=-1,nthreads=-1,allfiles=[]):
     for f in allfiles[p1:p2]:
         try:
             h5 = GETTERS.open_h5_file_read(f)
+            song = GETTERS.read_song(h5,0)
             for getter in getters:
                 tmp = GETTERS.__getattribute__(getter)(h5)
+                field = getter[4:]
+                if field in song and not same_value(tmp,song[field]):
+                    raise ValueError(getter+' and read_song disagree')
+            for songidx in xrange(1,GETTERS.get_num_songs(h5)):
+                tmp = GETTERS.read_song(h5,songidx)
         except KeyboardInterrupt:
             raise KeyboardInterruptError()
         except Exception,e:
@@ -0,0 +1,200 @@
+"""
+Thierry Bertin-Mahieux (2010) Columbia University
+tb2332@columbia.edu
+
+This code lists the leaves of the Million Song Dataset directory,
+i.e. the directories basedir/A/B/C that contain the song files.
+Listing a directory is mostly waiting for the filesystem (especially
+on network storage), so the 26*26*26 leaves are listed by a pool
+of threads instead of one after the other with os.walk and glob.
+We use scandir (os.scandir or the scandir module) if it is available,
+it saves a stat per entry, os.listdir otherwise.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2010, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+try:
+    from os import scandir as SCANDIR # python 3.5
+except ImportError:
+    try:
+        from scandir import scandir as SCANDIR # pip install scandir
+    except ImportError:
+        SCANDIR = None
+
+# number of threads listing directories
+NTHREADS = 16
+
+
+def list_subdirs(dirname):
+    """
+    Subdirectories of a directory (full paths), sorted.
+    Empty list if the directory does not exist.
+    """
+    res = []
+    try:
+        if SCANDIR is None:
+            for name in os.listdir(dirname):
+                path = os.path.join(dirname,name)
+                if os.path.isdir(path):
+                    res.append(path)
+        else:
+            for entry in SCANDIR(dirname):
+                if entry.is_dir():
+                    res.append(entry.path)
+    except OSError:
+        pass
+    return sorted(res)
+
+
+def list_files(dirname,ext='.h5',stats=False):
+    """
+    Files of a directory with the given extension (full paths).
+    If stats, we return tuples (path, size, modif date) instead.
+    Empty list if the directory does not exist.
+    """
+    res = []
+    try:
+        if SCANDIR is None:
+            for name in os.listdir(dirname):
+                if not name.endswith(ext):
+                    continue
+                path = os.path.join(dirname,name)
+                if stats:
+                    st = os.stat(path)
+                    res.append((path,st.st_size,st.st_mtime))
+                else:
+                    res.append(path)
+        else:
+            for entry in SCANDIR(dirname):
+                if not entry.name.endswith(ext):
+                    continue
+                if stats:
+                    st = entry.stat()
+                    res.append((entry.path,st.st_size,st.st_mtime))
+                else:
+                    res.append(entry.path)
+    except OSError:
+        pass
+    return res
+
+
+def thread_map(func,args,nthreads=NTHREADS):
+    """
+    map(func,args) computed by a pool of nthreads threads
+    """
+    if nthreads <= 1 or len(args) <= 1:
+        return map(func,args)
+    pool = ThreadPool(processes=min(nthreads,len(args)))
+    try:
+        res = pool.map(func,args)
+        pool.close()
+        pool.join()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    return res
+
+
+def get_leaves(basedir,nthreads=NTHREADS):
+    """
+    All leaves basedir/A/B/C (full paths), sorted.
+    The second level directories are listed in parallel.
+    """
+    basedir = os.path.abspath(basedir)
+    level1 = list_subdirs(basedir)
+    leaves = []
+    for subdirs in thread_map(list_subdirs,level1,nthreads):
+        leaves.extend(subdirs)
+    level2 = leaves
+    leaves = []
+    for subdirs in thread_map(list_subdirs,level2,nthreads):
+        leaves.extend(subdirs)
+    return leaves
+
+
+def scan_leaves(basedir,ext='.h5',stats=False,nthreads=NTHREADS):
+    """
+    List the files of all leaves in parallel.
+    INPUT
+       basedir   - main directory of the dataset
+       ext       - extension of the files we want
+       stats     - if True, also get size and modif date of each file
+       nthreads  - number of threads listing leaves
+    RETURN
+       dictionary, leaf -> list of files in it, see list_files
+       (empty leaves are included)
+    """
+    leaves = get_leaves(basedir,nthreads=nthreads)
+    func = lambda leaf: list_files(leaf,ext=ext,stats=stats)
+    return dict(zip(leaves,thread_map(func,leaves,nthreads)))
+
+
+def count_files(basedir,ext='.h5',nthreads=NTHREADS):
+    """
+    Number of files with the given extension in the leaves
+    """
+    return sum(map(len,scan_leaves(basedir,ext=ext,nthreads=nthreads).values()))
+
+
+def die_with_usage():
+    """ HELP MENU """
+    print 'dataset_scanner.py'
+    print '   by T. Bertin-Mahieux (2010) Columbia University'
+    print '      tb2332@columbia.edu'
+    print 'Count the files in the leaves of the Million Song dataset'
+    print 'directory, the leaves are listed by many threads.'
+    print 'usage:'
+    print '   python dataset_scanner.py [FLAGS] <maindir>'
+    print 'FLAGS'
+    print '   -nthreads N  - number of threads, default is',NTHREADS
+    print '   -ext E       - file extension, default is .h5'
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+
+    # help menu
+    if len(sys.argv) < 2:
+        die_with_usage()
+
+    nthreads = NTHREADS
+    ext = '.h5'
+    while True:
+        if sys.argv[1] == '-nthreads':
+            nthreads = int(sys.argv[2])
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-ext':
+            ext = sys.argv[2]
+            sys.argv.pop(1)
+        else:
+            break
+        sys.argv.pop(1)
+
+    maindir = sys.argv[1]
+
+    t1 = time.time()
+    leaves = scan_leaves(maindir,ext=ext,nthreads=nthreads)
+    nfiles = sum(map(len,leaves.values()))
+    print 'found',nfiles,'files in',len(leaves),'leaves in',time.time()-t1,'seconds.'
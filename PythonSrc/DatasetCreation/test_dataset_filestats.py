@@ -0,0 +1,78 @@
+"""
+Thierry Bertin-Mahieux (2010) Columbia University
+tb2332@columbia.edu
+
+Tests of dataset_filestats.py, on a fake dataset directory
+(empty files in A/B/C leaves) in a temporary directory.
+To run them, from this directory:
+   python -m unittest test_dataset_filestats
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2010, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),'dataset_filestats.py')
+
+
+class FileStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        """ 12 files in 3 leaves, with different modif dates """
+        self.tmpdir = tempfile.mkdtemp()
+        for k in range(12):
+            leaf = os.path.join(self.tmpdir,'ABC'[k % 3],'A','A')
+            if not os.path.isdir(leaf):
+                os.makedirs(leaf)
+            filename = os.path.join(leaf,'TR%sAA%013d.h5' % ('ABC'[k % 3],k))
+            open(filename,'w').close()
+            os.utime(filename,(1e9 + k,1e9 + k))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def recent_files(self,*flags):
+        """ files printed by the script with these flags """
+        args = [sys.executable,SCRIPT] + list(flags) + [self.tmpdir]
+        proc = subprocess.Popen(args,stdout=subprocess.PIPE)
+        out = proc.communicate()[0]
+        self.assertEqual(proc.returncode,0)
+        return [line.split()[0] for line in out.split('\n') if '.h5 (' in line]
+
+    def test_k(self):
+        """ -k N prints the N most recent files """
+        recent = self.recent_files('-k','3')
+        self.assertEqual(len(recent),3)
+        self.assertEqual([os.path.basename(f)[-5:] for f in recent],
+                         ['11.h5','10.h5','09.h5'])
+
+    def test_default_k(self):
+        """ 5 files by default """
+        self.assertEqual(len(self.recent_files()),5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+This code creates one aggregate file per storage profile (compression
+and chunk size, see hdf5_utils.STORAGE_PROFILES) from the same song
+files, and measures write time, file size, and read speed when
+going through all songs in order or picking songs at random.
+It helps choosing the layout that fits a given workload.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import shutil
+import numpy as np
+import tables
+import hdf5_utils as HDF5
+import hdf5_getters as GETTERS
+import utils
+
+
+# arrays we read for each song, a typical feature extraction
+READ_ARRAYS = ('segments_start','segments_pitches','segments_timbre','beats_start')
+
+
+def read_songs(h5filename,songidxs):
+    """
+    Read the arrays in READ_ARRAYS and the tempo for the given songs
+    Return the time it took
+    """
+    t1 = time.time()
+    h5 = GETTERS.open_h5_file_read(h5filename)
+    arrayindex = GETTERS.ArrayIndex(h5)
+    for songidx in songidxs:
+        GETTERS.get_tempo(h5,songidx)
+        for name in READ_ARRAYS:
+            arrayindex.get_array(name,songidx)
+    h5.close()
+    return time.time() - t1
+
+
+def benchmark_profile(allh5,outdir,profile,nrandom=1000,segments_per_song=300):
+    """
+    Create the aggregate file for one profile, and time it
+    RETURN
+       dictionary with write time, file size (bytes), and the number
+       of songs read per second in order ('seq') and at random ('rand')
+    """
+    h5filename = os.path.join(outdir,'aggregate_'+profile+'.h5')
+    # write
+    t1 = time.time()
+    HDF5.create_aggregate_file(h5filename,expectedrows=len(allh5),force=True,
+                               profile=profile,segments_per_song=segments_per_song)
+    h5 = HDF5.open_h5_file_append(h5filename)
+    HDF5.fill_hdf5_aggregate_file(h5,allh5)
+    nsongs = GETTERS.get_num_songs(h5)
+    h5.close()
+    res = {'write':time.time() - t1,'size':os.path.getsize(h5filename)}
+    # sequential scan
+    res['seq'] = nsongs / max(1e-6,read_songs(h5filename,xrange(nsongs)))
+    # random songs
+    songidxs = np.random.randint(0,nsongs,size=nrandom)
+    res['rand'] = nrandom / max(1e-6,read_songs(h5filename,songidxs))
+    return res
+
+
+def die_with_usage():
+    """ HELP MENU """
+    print 'benchmark_storage_profiles.py'
+    print '   by T. Bertin-Mahieux (2011) Columbia University'
+    print '   tb2332@columbia.edu'
+    print ''
+    print 'Creates an aggregate file for each storage profile of'
+    print 'hdf5_utils.STORAGE_PROFILES, from the same song files, and'
+    print 'reports write time, file size, and read speed (songs per second)'
+    print 'in order (seq) and at random (rand).'
+    print ''
+    print 'usage:'
+    print '   python benchmark_storage_profiles.py [FLAGS] <H5 DIR>'
+    print 'PARAMS'
+    print '   H5 DIR      - directory contains h5 files (subdirs are checked)'
+    print 'FLAGS'
+    print '   -nrandom N  - number of songs read at random, default 1000'
+    print '   -segs N     - average number of segments per song, default 300'
+    print '   -outdir D   - where to write (and keep) the aggregate files,'
+    print '                 temporary directory by default'
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+
+    # help menu
+    if len(sys.argv) < 2:
+        die_with_usage()
+
+    # flags
+    nrandom = 1000
+    segments_per_song = 300
+    outdir = None
+    while True:
+        if sys.argv[1] == '-nrandom':
+            nrandom = int(sys.argv[2])
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-segs':
+            segments_per_song = int(sys.argv[2])
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-outdir':
+            outdir = sys.argv[2]
+            sys.argv.pop(1)
+        else:
+            break
+        sys.argv.pop(1)
+
+    # params
+    maindir = sys.argv[1]
+    if not os.path.isdir(maindir):
+        print 'ERROR: directory',maindir,'does not exists.'
+        sys.exit(0)
+    allh5 = utils.get_all_files(maindir,ext='.h5')
+    print 'found',len(allh5),'H5 files.'
+    keep = outdir is not None
+    if not keep:
+        outdir = tempfile.mkdtemp()
+    elif not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    # go through profiles
+    print 'profile         write (s)   size (MB)   seq (songs/s)   rand (songs/s)'
+    try:
+        for profile in sorted(HDF5.STORAGE_PROFILES.keys()):
+            complib = HDF5.STORAGE_PROFILES[profile]['complib']
+            if tables.whichLibVersion(complib) is None:
+                print '%-15s %s not available, skipped' % (profile,complib)
+                continue
+            res = benchmark_profile(allh5,outdir,profile,nrandom=nrandom,
+                                    segments_per_song=segments_per_song)
+            print '%-15s %9.2f   %9.2f   %13.1f   %14.1f' % (profile,res['write'],res['size']/1048576.,
+                                                            res['seq'],res['rand'])
+    finally:
+        if not keep:
+            shutil.rmtree(outdir)
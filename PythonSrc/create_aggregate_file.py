@@ -30,10 +30,136 @@ import sys
 import glob
 import time
 import datetime
+import multiprocessing
+import numpy as np
 import hdf5_utils as HDF5
 import utils
 
 
+# error passing problems
+class KeyboardInterruptError(Exception):pass
+
+
+def create_shard(shardfile,h5filenames,precision='float64',pitches_precision=None,
+                 fields=None):
+    """
+    Create an aggregate file (a shard) from some of the song files.
+    Shards are temporary, they are not compressed.
+    """
+    HDF5.create_aggregate_file(shardfile,expectedrows=max(1,len(h5filenames)),
+                               force=True,complevel=0,precision=precision,
+                               pitches_precision=pitches_precision,fields=fields)
+    h5 = HDF5.open_h5_file_append(shardfile)
+    try:
+        HDF5.fill_hdf5_aggregate_file(h5,h5filenames,summaryfile=False)
+    finally:
+        h5.close()
+
+
+def create_shard_wrapper(args):
+    """ wrapper for multiprocessing to call the real function """
+    try:
+        create_shard(**args)
+    except KeyboardInterrupt:
+        raise KeyboardInterruptError()
+
+
+def create_shards(output,h5filenames,nthreads,precision='float64',pitches_precision=None,
+                  fields=None):
+    """
+    Split the song files in nthreads consecutive parts, each process
+    creates one shard aggregate file: output_shard0.h5, output_shard1.h5, ...
+    RETURN
+       list of shard filenames, in the order of the song files
+    """
+    files_per_thread = int(np.ceil(len(h5filenames) * 1. / nthreads))
+    shards = []
+    params_list = []
+    for k in range(nthreads):
+        shardfile = os.path.splitext(output)[0] + '_shard' + str(k) + '.h5'
+        shards.append(shardfile)
+        params = {'shardfile':shardfile,
+                  'h5filenames':h5filenames[files_per_thread*k:files_per_thread*(k+1)],
+                  'precision':precision,'pitches_precision':pitches_precision,
+                  'fields':fields}
+        params_list.append(params)
+    pool = multiprocessing.Pool(processes=nthreads)
+    try:
+        pool.map(create_shard_wrapper, params_list)
+        pool.close()
+        pool.join()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    return shards
+
+
+def count_rows(h5filenames):
+    """
+    Sum count_file_rows (hdf5_utils) over the given files
+    RETURN
+       dictionary, 'songs' -> number of songs, array name -> number of rows
+    """
+    total = {}
+    for h5filename in h5filenames:
+        for name,nrows in HDF5.count_file_rows(h5filename).items():
+            total[name] = total.get(name,0) + nrows
+    return total
+
+
+def count_rows_wrapper(h5filenames):
+    """ wrapper for multiprocessing to call the real function """
+    try:
+        return count_rows(h5filenames)
+    except KeyboardInterrupt:
+        raise KeyboardInterruptError()
+
+
+def count_all_rows(h5filenames,nthreads=1,chunksize=1000):
+    """
+    Exact number of songs and of rows in each array of the aggregate
+    file we will create from these files, only the shapes of the arrays
+    are read. nthreads processes count chunksize files at a time.
+    RETURN
+       dictionary, 'songs' -> number of songs, array name -> number of rows
+    """
+    chunks = [h5filenames[k:k+chunksize] for k in xrange(0,len(h5filenames),chunksize)]
+    if nthreads <= 1:
+        counts = map(count_rows,chunks)
+    else:
+        pool = multiprocessing.Pool(processes=nthreads)
+        try:
+            counts = pool.map(count_rows_wrapper,chunks)
+            pool.close()
+            pool.join()
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+    total = {'songs':0}
+    for count in counts:
+        for name,nrows in count.items():
+            total[name] = total.get(name,0) + nrows
+    return total
+
+
+def merge_shards(h5,shards,skip_existing=False):
+    """
+    Append the songs of all shards, in order, to an open aggregate file.
+    Indices of each shard are moved by one vectorized addition, from the
+    length of the arrays before that shard (see AggregateWriter.append_file).
+    If skip_existing=True, songs already in h5 are not added.
+    RETURN
+       number of songs skipped
+    """
+    writer = HDF5.AggregateWriter(h5,skip_existing=skip_existing)
+    for shard in shards:
+        writer.append_file(shard)
+    writer.flush()
+    return writer.nskipped
+
+
 def die_with_usage():
     """ HELP MENU """
     print 'create_aggregate_file.py'
@@ -45,10 +171,38 @@ def die_with_usage():
     print 'Aggregate files contains many songs. and none of the arrays,'
     print ''
     print 'usage:'
-    print '   python create_aggregate_file.py <H5 DIR> <OUTPUT.h5>'
+    print '   python create_aggregate_file.py [FLAGS] <H5 DIR> <OUTPUT.h5>'
     print 'PARAMS'
     print '   H5 DIR     - directory contains h5 files (subdirs are checked)'
     print '   OUTPUT.h5  - filename of the aggregate file to create'
+    print 'FLAGS'
+    print '   -precision P  - type of the analysis arrays, float64 (default),'
+    print '                   float32 to halve the file size, or float16'
+    print '   -pitches P    - type of segments_pitches, same as precision by'
+    print '                   default, can also be uint8 (quantized)'
+    print '   -profile P    - storage profile: default, fastread, archive'
+    print '                   or nocompression (see hdf5_utils.STORAGE_PROFILES)'
+    print '   -index        - add a track id index to the file, to find songs'
+    print '                   quickly by track id (hdf5_getters.find_songidx)'
+    print '   -nthreads N   - N processes read the song files, each creates a'
+    print '                   temporary shard file, shards are then merged'
+    print '   -exactsize    - count the songs and array rows of all files first'
+    print '                   (in parallel with -nthreads) to size the arrays'
+    print '   -vocab        - similar_artists and artist_terms stored as codes'
+    print '                   in a vocabulary (much smaller), getters decode them'
+    print '   -artists      - artist fields (familiarity, terms, ...) stored once'
+    print '                   per artist in a table /metadata/artists'
+    print '   -fields F     - comma-separated list of fields to keep, e.g.'
+    print '                   artist_id,segments_start,segments_timbre'
+    print '                   (track_id and indices are always kept, and'
+    print '                   artist_id with -artists)'
+    print '   -append       - if OUTPUT.h5 exists, add the songs it does not'
+    print '                   contain yet (known track ids are skipped)'
+    print '   -resume       - continue an interrupted run from its last'
+    print '                   checkpoint, with the same H5 DIR and flags'
+    print '                   (not with -nthreads)'
+    print '   -manifest M   - list the h5 files from manifest M, refreshed first'
+    print '                   (see file_manifest.py), instead of walking H5 DIR'
     sys.exit(0)
 
 
@@ -58,6 +212,54 @@ if __name__ == '__main__':
     if len(sys.argv)<3:
         die_with_usage()
 
+    # flags
+    precision = 'float64'
+    pitches_precision = None
+    profile = None
+    index = False
+    nthreads = 1
+    append = False
+    fields = None
+    resume = False
+    exactsize = False
+    encode_strings = False
+    artist_table = False
+    manifest = None
+    while True:
+        if sys.argv[1] == '-precision':
+            precision = sys.argv[2]
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-pitches':
+            pitches_precision = sys.argv[2]
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-profile':
+            profile = sys.argv[2]
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-index':
+            index = True
+        elif sys.argv[1] == '-nthreads':
+            nthreads = int(sys.argv[2])
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-fields':
+            fields = sys.argv[2].split(',')
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-append':
+            append = True
+        elif sys.argv[1] == '-resume':
+            resume = True
+        elif sys.argv[1] == '-exactsize':
+            exactsize = True
+        elif sys.argv[1] == '-vocab':
+            encode_strings = True
+        elif sys.argv[1] == '-artists':
+            artist_table = True
+        elif sys.argv[1] == '-manifest':
+            manifest = sys.argv[2]
+            sys.argv.pop(1)
+        else:
+            break
+        sys.argv.pop(1)
+
     # params
     maindir = sys.argv[1]
     output = sys.argv[2]
@@ -66,25 +268,79 @@ if __name__ == '__main__':
     if not os.path.isdir(maindir):
         print 'ERROR: directory',maindir,'does not exists.'
         sys.exit(0)
-    if os.path.isfile(output):
+    if not precision in HDF5.ARRAY_PRECISIONS:
+        print 'ERROR: precision must be one of',', '.join(HDF5.ARRAY_PRECISIONS)
+        sys.exit(0)
+    if pitches_precision is not None and not pitches_precision in HDF5.PITCHES_PRECISIONS:
+        print 'ERROR: pitches precision must be one of',', '.join(HDF5.PITCHES_PRECISIONS)
+        sys.exit(0)
+    append = append and os.path.isfile(output)
+    if resume:
+        if not os.path.isfile(output):
+            print 'ERROR: file',output,'does not exist, nothing to resume.'
+            sys.exit(0)
+        if nthreads > 1:
+            print 'ERROR: can not resume with more than one process.'
+            sys.exit(0)
+    elif os.path.isfile(output) and not append:
         print 'ERROR: file',output,'exists, delete or provide a new filename.'
         sys.exit(0)
 
     # start time
     t1 = time.time()
 
-    # get all h5 files
-    allh5 = utils.get_all_files(maindir,ext='.h5')
+    # get all h5 files, sorted so a resumed run sees them in the same order
+    allh5 = sorted(utils.get_all_files(maindir,ext='.h5',manifest=manifest))
     print 'found',len(allh5),'H5 files.'
 
     # create aggregate file
-    HDF5.create_aggregate_file(output,expectedrows=len(allh5),
-                               summaryfile=False)
-    print 'Aggregate file created, we start filling it.'
+    if resume:
+        print 'Aggregate file exists, we resume filling it.'
+    elif append:
+        print 'Aggregate file exists, we add the new songs.'
+    else:
+        expectedrows = len(allh5)
+        arrayrows = None
+        if exactsize:
+            arrayrows = count_all_rows(allh5,nthreads=nthreads)
+            expectedrows = arrayrows.pop('songs')
+            print 'Counted',expectedrows,'songs and',arrayrows.get('segments_start',0),'segments.'
+        HDF5.create_aggregate_file(output,expectedrows=expectedrows,
+                                   summaryfile=False,precision=precision,
+                                   pitches_precision=pitches_precision,
+                                   profile=profile,fields=fields,arrayrows=arrayrows,
+                                   encode_strings=encode_strings,artist_table=artist_table)
+        print 'Aggregate file created, we start filling it.'
 
     # fill it
-    h5 = HDF5.open_h5_file_append(output)
-    HDF5.fill_hdf5_aggregate_file(h5,allh5,summaryfile=False)
+    if nthreads > 1:
+        shards = create_shards(output,allh5,nthreads,precision=precision,
+                               pitches_precision=pitches_precision,fields=fields)
+        print 'Created',len(shards),'shards, we merge them.'
+        h5 = HDF5.open_h5_file_append(output)
+        nskipped = merge_shards(h5,shards,skip_existing=append)
+        for shard in shards:
+            os.remove(shard)
+    else:
+        h5 = HDF5.open_h5_file_append(output)
+        nfilesdone = 0
+        if resume:
+            try:
+                nfilesdone = HDF5.resume_aggregate_file(h5)
+            except ValueError:
+                print 'ERROR: no checkpoint in',output,'can not resume.'
+                h5.close()
+                sys.exit(0)
+            print 'Resuming after',nfilesdone,'files.'
+        # progress saved in the file after each batch, in case we die
+        nskipped = HDF5.fill_hdf5_aggregate_file(h5,allh5[nfilesdone:],summaryfile=False,
+                                                 skip_existing=append,checkpoint=True,
+                                                 nfilesdone=nfilesdone)
+    if append:
+        print 'Skipped',nskipped,'songs already in the file.'
+    # an existing index is outdated once we added songs
+    if index or 'track_id_index' in h5.root.analysis._v_children:
+        HDF5.create_track_id_index(h5)
     h5.close()
 
     # done!
@@ -47,10 +47,17 @@ def die_with_usage():
     print 'i.e. no beat/segment data, artist similarity, tags, ...'
     print ''
     print 'usage:'
-    print '   python create_summary_file.py <H5 DIR> <OUTPUT.h5>'
+    print '   python create_summary_file.py [FLAGS] <H5 DIR> <OUTPUT.h5>'
     print 'PARAMS'
     print '   H5 DIR     - directory contains h5 files (subdirs are checked)'
     print '   OUTPUT.h5  - filename of the summary file to create'
+    print 'FLAGS'
+    print '   -index     - add a track id index to the file, to find songs'
+    print '                quickly by track id (hdf5_getters.find_songidx)'
+    print '   -append    - if OUTPUT.h5 exists, add the songs it does not'
+    print '                contain yet (known track ids are skipped)'
+    print '   -manifest M - list the h5 files from manifest M, refreshed first'
+    print '                (see file_manifest.py), instead of walking H5 DIR'
     sys.exit(0)
 
 
@@ -60,6 +67,22 @@ if __name__ == '__main__':
     if len(sys.argv)<3:
         die_with_usage()
 
+    # flags
+    index = False
+    append = False
+    manifest = None
+    while True:
+        if sys.argv[1] == '-index':
+            index = True
+        elif sys.argv[1] == '-append':
+            append = True
+        elif sys.argv[1] == '-manifest':
+            manifest = sys.argv[2]
+            sys.argv.pop(1)
+        else:
+            break
+        sys.argv.pop(1)
+
     # params
     maindir = sys.argv[1]
     output = sys.argv[2]
@@ -68,7 +91,8 @@ if __name__ == '__main__':
     if not os.path.isdir(maindir):
         print 'ERROR: directory',maindir,'does not exists.'
         sys.exit(0)
-    if os.path.isfile(output):
+    append = append and os.path.isfile(output)
+    if os.path.isfile(output) and not append:
         print 'ERROR: file',output,'exists, delete or provide a new filename.'
         sys.exit(0)
 
@@ -76,17 +100,26 @@ if __name__ == '__main__':
     t1 = time.time()
 
     # get all h5 files
-    allh5 = utils.get_all_files(maindir,ext='.h5')
+    allh5 = utils.get_all_files(maindir,ext='.h5',manifest=manifest)
     print 'found',len(allh5),'H5 files.'
 
     # create summary file
-    HDF5.create_aggregate_file(output,expectedrows=len(allh5),
-                               summaryfile=True)
-    print 'Summary file created, we start filling it.'
+    if append:
+        print 'Summary file exists, we add the new songs.'
+    else:
+        HDF5.create_aggregate_file(output,expectedrows=len(allh5),
+                                   summaryfile=True)
+        print 'Summary file created, we start filling it.'
 
     # fill it
     h5 = HDF5.open_h5_file_append(output)
-    HDF5.fill_hdf5_aggregate_file(h5,allh5,summaryfile=True)
+    nskipped = HDF5.fill_hdf5_aggregate_file(h5,allh5,summaryfile=True,
+                                             skip_existing=append)
+    if append:
+        print 'Skipped',nskipped,'songs already in the file.'
+    # an existing index is outdated once we added songs
+    if index or 'track_id_index' in h5.root.analysis._v_children:
+        HDF5.create_track_id_index(h5)
     h5.close()
 
     # done!
@@ -0,0 +1,243 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+This code keeps a manifest of the song files: path, track id, size
+and modification time of every h5 file under a directory, in a small
+SQLite file. Walking the million files of the A/B/C tree takes minutes
+(more on network storage), reading the manifest takes a second.
+The manifest is refreshed incrementally: a directory is listed again
+only if its own modification time changed, i.e. if files were added,
+removed or renamed in it.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import datetime
+try:
+    import sqlite3
+except ImportError:
+    print 'you need sqlite3 installed to use this program'
+    sys.exit(0)
+
+
+def open_manifest(filename):
+    """
+    Open a manifest file, create its tables if it is new.
+    RETURN
+       sqlite3 connection
+    """
+    conn = sqlite3.connect(filename)
+    conn.text_factory = str
+    q = 'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dirname TEXT,'
+    q += ' track_id TEXT, size INTEGER, mtime REAL)'
+    conn.execute(q)
+    conn.execute('CREATE TABLE IF NOT EXISTS dirs (dirname TEXT PRIMARY KEY, mtime REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_dirname ON files (dirname)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_track_id ON files (track_id)')
+    conn.commit()
+    return conn
+
+
+def in_basedir(path,basedir):
+    """
+    True if path is basedir or under it (both absolute)
+    """
+    return path == basedir or path.startswith(os.path.join(basedir,''))
+
+
+def refresh_manifest(conn,basedir,ext='.h5',verbose=False):
+    """
+    Bring the manifest up to date with the files under basedir.
+    Starting from basedir, each directory is stat'ed; if its modification
+    time is the one we recorded, its files are unchanged and we only go
+    down into its known subdirectories. Otherwise it is listed again, and
+    its files stat'ed. Directories that disappeared are removed.
+    Files rewritten in place (same name) are not seen, use a full refresh
+    (empty manifest) for that.
+    Directories modified during the last two seconds are not trusted
+    (coarse mtime resolution), they are listed again next time.
+    RETURN
+       number of directories listed, number of files in the manifest
+    """
+    basedir = os.path.abspath(basedir)
+    tstart = time.time()
+    known = {}
+    children = {}
+    for dirname,mtime in conn.execute('SELECT dirname,mtime FROM dirs'):
+        if not in_basedir(dirname,basedir):
+            continue
+        known[dirname] = mtime
+        if dirname != basedir:
+            children.setdefault(os.path.dirname(dirname),[]).append(dirname)
+    seen = set()
+    nlisted = 0
+    todo = [basedir]
+    while len(todo) > 0:
+        dirname = todo.pop()
+        try:
+            mtime = os.stat(dirname).st_mtime
+        except OSError:
+            continue # removed
+        seen.add(dirname)
+        if known.get(dirname) == mtime:
+            todo.extend(children.get(dirname,[]))
+            continue
+        # new or changed directory, list it
+        nlisted += 1
+        rows = []
+        for name in os.listdir(dirname):
+            path = os.path.join(dirname,name)
+            if os.path.isdir(path):
+                todo.append(path)
+            elif name.endswith(ext):
+                st = os.stat(path)
+                rows.append((path,dirname,name[:-len(ext)],st.st_size,st.st_mtime))
+        conn.execute('DELETE FROM files WHERE dirname=?',(dirname,))
+        conn.executemany('INSERT INTO files VALUES (?,?,?,?,?)',rows)
+        if mtime > tstart - 2:
+            mtime = -1.
+        conn.execute('INSERT OR REPLACE INTO dirs VALUES (?,?)',(dirname,mtime))
+        if verbose and nlisted % 1000 == 0:
+            print 'listed',nlisted,'directories'
+    # forget directories that disappeared
+    for dirname in known:
+        if not dirname in seen:
+            conn.execute('DELETE FROM files WHERE dirname=?',(dirname,))
+            conn.execute('DELETE FROM dirs WHERE dirname=?',(dirname,))
+    conn.commit()
+    return nlisted, count_files(conn,basedir)
+
+
+def count_files(conn,basedir=None):
+    """
+    Number of files in the manifest, under basedir if given
+    """
+    if basedir is None:
+        return conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+    basedir = os.path.abspath(basedir)
+    q = "SELECT COUNT(*) FROM files WHERE dirname=? OR dirname LIKE ? ESCAPE '\\'"
+    return conn.execute(q,(basedir,like_prefix(basedir))).fetchone()[0]
+
+
+def like_prefix(basedir):
+    """
+    LIKE pattern matching the subdirectories of basedir
+    """
+    prefix = os.path.join(basedir,'')
+    prefix = prefix.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')
+    return prefix + '%'
+
+
+def get_manifest_files(conn,basedir=None):
+    """
+    All paths in the manifest (under basedir if given), sorted
+    """
+    if basedir is None:
+        res = conn.execute('SELECT path FROM files ORDER BY path')
+    else:
+        basedir = os.path.abspath(basedir)
+        q = "SELECT path FROM files WHERE dirname=? OR dirname LIKE ? ESCAPE '\\'"
+        q += ' ORDER BY path'
+        res = conn.execute(q,(basedir,like_prefix(basedir)))
+    return [row[0] for row in res]
+
+
+def get_manifest_rows(conn,basedir=None):
+    """
+    All (path, track_id, size, mtime) in the manifest (under basedir
+    if given), sorted by path
+    """
+    q = 'SELECT path,track_id,size,mtime FROM files'
+    if basedir is None:
+        return conn.execute(q+' ORDER BY path').fetchall()
+    basedir = os.path.abspath(basedir)
+    q += " WHERE dirname=? OR dirname LIKE ? ESCAPE '\\' ORDER BY path"
+    return conn.execute(q,(basedir,like_prefix(basedir))).fetchall()
+
+
+def find_track(conn,track_id):
+    """
+    Path of a track id in the manifest, None if unknown
+    """
+    res = conn.execute('SELECT path FROM files WHERE track_id=?',(track_id,)).fetchone()
+    if res is None:
+        return None
+    return res[0]
+
+
+def die_with_usage():
+    """ HELP MENU """
+    print 'file_manifest.py'
+    print '   by T. Bertin-Mahieux (2011) Columbia University'
+    print '   tb2332@columbia.edu'
+    print ''
+    print 'Creates or refreshes the manifest of the h5 files in a directory,'
+    print 'only directories modified since the last refresh are listed.'
+    print 'utils.get_all_files(maindir,manifest=MANIFEST) then reads it.'
+    print ''
+    print 'usage:'
+    print '   python file_manifest.py [FLAGS] <H5 DIR> <MANIFEST>'
+    print 'PARAMS'
+    print '   H5 DIR     - directory contains h5 files (subdirs are checked)'
+    print '   MANIFEST   - SQLite file, created if it does not exist'
+    print 'FLAGS'
+    print '   -full      - forget what the manifest knows, list everything'
+    print '                (to see files rewritten in place)'
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+
+    # help menu
+    if len(sys.argv) < 3:
+        die_with_usage()
+
+    # flags
+    full = False
+    while True:
+        if sys.argv[1] == '-full':
+            full = True
+        else:
+            break
+        sys.argv.pop(1)
+
+    # params
+    maindir = sys.argv[1]
+    manifest = sys.argv[2]
+
+    # sanity checks
+    if not os.path.isdir(maindir):
+        print 'ERROR: directory',maindir,'does not exists.'
+        sys.exit(0)
+
+    # refresh
+    t1 = time.time()
+    conn = open_manifest(manifest)
+    if full:
+        conn.execute('DELETE FROM files')
+        conn.execute('DELETE FROM dirs')
+    nlisted,nfiles = refresh_manifest(conn,maindir,verbose=True)
+    conn.close()
+    stimelength = str(datetime.timedelta(seconds=time.time()-t1))
+    print 'listed',nlisted,'directories,',nfiles,'files in the manifest, in:',stimelength
@@ -28,7 +28,59 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
+import os
+import weakref
 import tables
+import numpy as np
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None # Python < 2.7, no H5FilePool
+
+# groups that contain a 'songs' table, one row per song
+SONG_TABLES = ('metadata','analysis','musicbrainz')
+
+# for each array: group it belongs to, and column holding the index
+# of the first element of each song in that array
+ARRAY_INDICES = {'similar_artists':('metadata','idx_similar_artists'),
+                 'artist_terms':('metadata','idx_artist_terms'),
+                 'artist_terms_freq':('metadata','idx_artist_terms'),
+                 'artist_terms_weight':('metadata','idx_artist_terms'),
+                 'segments_start':('analysis','idx_segments_start'),
+                 'segments_confidence':('analysis','idx_segments_confidence'),
+                 'segments_pitches':('analysis','idx_segments_pitches'),
+                 'segments_timbre':('analysis','idx_segments_timbre'),
+                 'segments_loudness_max':('analysis','idx_segments_loudness_max'),
+                 'segments_loudness_max_time':('analysis','idx_segments_loudness_max_time'),
+                 'segments_loudness_start':('analysis','idx_segments_loudness_start'),
+                 'sections_start':('analysis','idx_sections_start'),
+                 'sections_confidence':('analysis','idx_sections_confidence'),
+                 'beats_start':('analysis','idx_beats_start'),
+                 'beats_confidence':('analysis','idx_beats_confidence'),
+                 'bars_start':('analysis','idx_bars_start'),
+                 'bars_confidence':('analysis','idx_bars_confidence'),
+                 'tatums_start':('analysis','idx_tatums_start'),
+                 'tatums_confidence':('analysis','idx_tatums_confidence'),
+                 'artist_mbtags':('musicbrainz','idx_artist_mbtags'),
+                 'artist_mbtags_count':('musicbrainz','idx_artist_mbtags')}
+
+# segments_pitches stored as uint8: value in [0,1] times this scale
+PITCHES_UINT8_SCALE = 255.
+
+# string arrays that can be stored as codes in a vocabulary, the
+# vocabulary is a node named like the array plus this suffix
+VOCAB_ARRAYS = ('similar_artists','artist_terms')
+VOCAB_SUFFIX = '_vocab'
+
+# fields that are the same for all songs of an artist, they can be stored
+# once per artist in a table /metadata/artists (see artist_table in
+# hdf5_utils.create_aggregate_file), songs point to it with artist_row
+ARTIST_COLUMNS = ('artist_familiarity','artist_hotttnesss','artist_latitude',
+                  'artist_location','artist_longitude')
+ARTIST_ARRAYS = ('similar_artists','artist_terms','artist_terms_freq','artist_terms_weight')
+
+# vocabularies read so far, per open file, see read_vocab
+VOCAB_CACHE = weakref.WeakKeyDictionary()
 
 
 def open_h5_file_read(h5filename):
@@ -39,6 +91,128 @@ def open_h5_file_read(h5filename):
     return tables.openFile(h5filename, mode='r')
 
 
+class H5FilePool(object):
+    """
+    Bounded pool of H5 files open in read mode, keyed by path.
+    When we read the same (small) song files again and again, e.g. hot
+    tracks in a server, reopening them costs more than reading them.
+    The least recently used file is closed when we have too many.
+    Files open in another process (we got forked) are forgotten, each
+    process reopens its own.
+    Files from the pool must NOT be closed by the caller, use close_all.
+    """
+    def __init__(self,maxopen=128):
+        assert maxopen > 0,'maxopen must be positive'
+        self.maxopen = maxopen
+        self.pid = os.getpid()
+        self.files = OrderedDict()
+
+    def open(self,h5filename):
+        """
+        Return the open file for that path, open it if needed
+        """
+        if self.pid != os.getpid():
+            # forked, these handles belong to the parent
+            self.files = OrderedDict()
+            self.pid = os.getpid()
+        key = os.path.abspath(h5filename)
+        h5 = self.files.pop(key,None)
+        if h5 is None or not h5.isopen:
+            h5 = tables.openFile(key, mode='r')
+        self.files[key] = h5 # most recently used at the end
+        while len(self.files) > self.maxopen:
+            oldkey,oldh5 = self.files.popitem(last=False)
+            oldh5.close()
+        return h5
+
+    def close_all(self):
+        """
+        Close all files in the pool
+        """
+        while len(self.files) > 0:
+            key,h5 = self.files.popitem()
+            if self.pid == os.getpid() and h5.isopen:
+                h5.close()
+
+# default pool, see open_h5_file_read_pooled
+H5POOL = H5FilePool() if OrderedDict is not None else None
+
+
+def open_h5_file_read_pooled(h5filename):
+    """
+    Same as open_h5_file_read, but the file is kept open in the default
+    H5FilePool and reused the next time. Do not close it yourself!
+    Needs Python 2.7 (collections.OrderedDict).
+    """
+    if H5POOL is None:
+        raise RuntimeError('open_h5_file_read_pooled needs collections.OrderedDict'
+                           +' (Python 2.7), use open_h5_file_read')
+    return H5POOL.open(h5filename)
+
+
+def decode_array(array,upcast=False,name=None):
+    """
+    Analysis arrays can be stored with reduced precision, see precision
+    and pitches_precision in hdf5_utils.create_all_arrays.
+    Pitches quantized as uint8 (name is 'segments_pitches') are put back
+    in [0,1] (as float32).
+    If upcast, float16 / float32 arrays are returned as float64.
+    Other arrays are returned as is.
+    """
+    if name == 'segments_pitches' and array.dtype == np.uint8:
+        return array.astype('float64' if upcast else 'float32') / PITCHES_UINT8_SCALE
+    if upcast and array.dtype.kind == 'f' and array.dtype.itemsize < 8:
+        return array.astype('float64')
+    return array
+
+
+def read_vocab(h5array):
+    """
+    Vocabulary of a string array stored as codes (see encode_strings in
+    hdf5_utils.create_all_arrays), as a numpy array of strings, i.e.
+    vocab[codes] are the strings. None if the array has no vocabulary.
+    Vocabularies are read once per open file, again only if they grew.
+    """
+    group = h5array._v_parent
+    name = h5array._v_name + VOCAB_SUFFIX
+    if not name in group._v_children:
+        return None
+    vocab = group._v_children[name]
+    vocabs = VOCAB_CACHE.setdefault(h5array._v_file,{})
+    if not name in vocabs or vocabs[name].shape[0] != vocab.nrows:
+        vocabs[name] = vocab.read()
+    return vocabs[name]
+
+
+def decode_strings(h5array,data):
+    """
+    Data read from a string array (e.g. artist_terms), back to strings
+    if they are stored as codes. Returned as is otherwise.
+    """
+    vocab = read_vocab(h5array)
+    if vocab is None:
+        return data
+    return vocab[data]
+
+
+def read_artist_field(h5,field,songidx=0):
+    """
+    Get a field of ARTIST_COLUMNS or ARTIST_ARRAYS for one song, in
+    a file where it is stored in the artists table.
+    Used by the getters, e.g. get_artist_terms.
+    """
+    artists = h5.root.metadata.artists
+    row = h5.root.metadata.songs.cols.artist_row[songidx]
+    if not field in ARRAY_INDICES:
+        return getattr(artists.cols,field)[row]
+    idxcol = ARRAY_INDICES[field][1]
+    array = h5.root.metadata._v_children[field]
+    if artists.nrows == row + 1:
+        return decode_strings(array,array[getattr(artists.cols,idxcol)[row]:])
+    return decode_strings(array,array[getattr(artists.cols,idxcol)[row]:
+                                      getattr(artists.cols,idxcol)[row+1]])
+
+
 def get_num_songs(h5):
     """
     Return the number of songs contained in this h5 file, i.e. the number of rows
@@ -50,12 +224,16 @@ def get_artist_familiarity(h5,songidx=0):
     """
     Get artist familiarity from a HDF5 song file, by default the first song in it
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_familiarity',songidx)
     return h5.root.metadata.songs.cols.artist_familiarity[songidx]
 
 def get_artist_hotttnesss(h5,songidx=0):
     """
     Get artist hotttnesss from a HDF5 song file, by default the first song in it
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_hotttnesss',songidx)
     return h5.root.metadata.songs.cols.artist_hotttnesss[songidx]
 
 def get_artist_id(h5,songidx=0):
@@ -86,18 +264,24 @@ def get_artist_latitude(h5,songidx=0):
     """
     Get artist latitude from a HDF5 song file, by default the first song in it
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_latitude',songidx)
     return h5.root.metadata.songs.cols.artist_latitude[songidx]
 
 def get_artist_longitude(h5,songidx=0):
     """
     Get artist longitude from a HDF5 song file, by default the first song in it
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_longitude',songidx)
     return h5.root.metadata.songs.cols.artist_longitude[songidx]
 
 def get_artist_location(h5,songidx=0):
     """
     Get artist location from a HDF5 song file, by default the first song in it
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_location',songidx)
     return h5.root.metadata.songs.cols.artist_location[songidx]
 
 def get_artist_name(h5,songidx=0):
@@ -148,10 +332,14 @@ def get_similar_artists(h5,songidx=0):
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'similar_artists',songidx)
     if h5.root.metadata.songs.nrows == songidx + 1:
-        return h5.root.metadata.similar_artists[h5.root.metadata.songs.cols.idx_similar_artists[songidx]:]
-    return h5.root.metadata.similar_artists[h5.root.metadata.songs.cols.idx_similar_artists[songidx]:
-                                            h5.root.metadata.songs.cols.idx_similar_artists[songidx+1]]
+        return decode_strings(h5.root.metadata.similar_artists,
+                              h5.root.metadata.similar_artists[h5.root.metadata.songs.cols.idx_similar_artists[songidx]:])
+    return decode_strings(h5.root.metadata.similar_artists,
+                          h5.root.metadata.similar_artists[h5.root.metadata.songs.cols.idx_similar_artists[songidx]:
+                                                           h5.root.metadata.songs.cols.idx_similar_artists[songidx+1]])
 
 def get_artist_terms(h5,songidx=0):
     """
@@ -159,10 +347,14 @@ def get_artist_terms(h5,songidx=0):
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_terms',songidx)
     if h5.root.metadata.songs.nrows == songidx + 1:
-        return h5.root.metadata.artist_terms[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:]
-    return h5.root.metadata.artist_terms[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:
-                                            h5.root.metadata.songs.cols.idx_artist_terms[songidx+1]]
+        return decode_strings(h5.root.metadata.artist_terms,
+                              h5.root.metadata.artist_terms[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:])
+    return decode_strings(h5.root.metadata.artist_terms,
+                          h5.root.metadata.artist_terms[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:
+                                                        h5.root.metadata.songs.cols.idx_artist_terms[songidx+1]])
 
 def get_artist_terms_freq(h5,songidx=0):
     """
@@ -170,6 +362,8 @@ def get_artist_terms_freq(h5,songidx=0):
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_terms_freq',songidx)
     if h5.root.metadata.songs.nrows == songidx + 1:
         return h5.root.metadata.artist_terms_freq[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:]
     return h5.root.metadata.artist_terms_freq[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:
@@ -181,6 +375,8 @@ def get_artist_terms_weight(h5,songidx=0):
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
     """
+    if 'artists' in h5.root.metadata._v_children:
+        return read_artist_field(h5,'artist_terms_weight',songidx)
     if h5.root.metadata.songs.nrows == songidx + 1:
         return h5.root.metadata.artist_terms_weight[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:]
     return h5.root.metadata.artist_terms_weight[h5.root.metadata.songs.cols.idx_artist_terms[songidx]:
@@ -282,170 +478,187 @@ def get_track_id(h5,songidx=0):
     """
     return h5.root.analysis.songs.cols.track_id[songidx]
 
-def get_segments_start(h5,songidx=0):
+def get_segments_start(h5,songidx=0,upcast=False):
     """
     Get segments start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_start[h5.root.analysis.songs.cols.idx_segments_start[songidx]:]
-    return h5.root.analysis.segments_start[h5.root.analysis.songs.cols.idx_segments_start[songidx]:
-                                           h5.root.analysis.songs.cols.idx_segments_start[songidx+1]]
+        return decode_array(h5.root.analysis.segments_start[h5.root.analysis.songs.cols.idx_segments_start[songidx]:],upcast)
+    return decode_array(h5.root.analysis.segments_start[h5.root.analysis.songs.cols.idx_segments_start[songidx]:
+                                                        h5.root.analysis.songs.cols.idx_segments_start[songidx+1]],upcast)
     
-def get_segments_confidence(h5,songidx=0):
+def get_segments_confidence(h5,songidx=0,upcast=False):
     """
     Get segments confidence array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_confidence[h5.root.analysis.songs.cols.idx_segments_confidence[songidx]:]
-    return h5.root.analysis.segments_confidence[h5.root.analysis.songs.cols.idx_segments_confidence[songidx]:
-                                                h5.root.analysis.songs.cols.idx_segments_confidence[songidx+1]]
+        return decode_array(h5.root.analysis.segments_confidence[h5.root.analysis.songs.cols.idx_segments_confidence[songidx]:],upcast)
+    return decode_array(h5.root.analysis.segments_confidence[h5.root.analysis.songs.cols.idx_segments_confidence[songidx]:
+                                                             h5.root.analysis.songs.cols.idx_segments_confidence[songidx+1]],upcast)
 
-def get_segments_pitches(h5,songidx=0):
+def get_segments_pitches(h5,songidx=0,upcast=False):
     """
     Get segments pitches array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_pitches[h5.root.analysis.songs.cols.idx_segments_pitches[songidx]:,:]
-    return h5.root.analysis.segments_pitches[h5.root.analysis.songs.cols.idx_segments_pitches[songidx]:
-                                             h5.root.analysis.songs.cols.idx_segments_pitches[songidx+1],:]
+        return decode_array(h5.root.analysis.segments_pitches[h5.root.analysis.songs.cols.idx_segments_pitches[songidx]:,:],upcast,
+                            name='segments_pitches')
+    return decode_array(h5.root.analysis.segments_pitches[h5.root.analysis.songs.cols.idx_segments_pitches[songidx]:
+                                                          h5.root.analysis.songs.cols.idx_segments_pitches[songidx+1],:],upcast,
+                        name='segments_pitches')
 
-def get_segments_timbre(h5,songidx=0):
+def get_segments_timbre(h5,songidx=0,upcast=False):
     """
     Get segments timbre array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_timbre[h5.root.analysis.songs.cols.idx_segments_timbre[songidx]:,:]
-    return h5.root.analysis.segments_timbre[h5.root.analysis.songs.cols.idx_segments_timbre[songidx]:
-                                            h5.root.analysis.songs.cols.idx_segments_timbre[songidx+1],:]
+        return decode_array(h5.root.analysis.segments_timbre[h5.root.analysis.songs.cols.idx_segments_timbre[songidx]:,:],upcast)
+    return decode_array(h5.root.analysis.segments_timbre[h5.root.analysis.songs.cols.idx_segments_timbre[songidx]:
+                                                         h5.root.analysis.songs.cols.idx_segments_timbre[songidx+1],:],upcast)
 
-def get_segments_loudness_max(h5,songidx=0):
+def get_segments_loudness_max(h5,songidx=0,upcast=False):
     """
     Get segments loudness max array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_loudness_max[h5.root.analysis.songs.cols.idx_segments_loudness_max[songidx]:]
-    return h5.root.analysis.segments_loudness_max[h5.root.analysis.songs.cols.idx_segments_loudness_max[songidx]:
-                                                  h5.root.analysis.songs.cols.idx_segments_loudness_max[songidx+1]]
+        return decode_array(h5.root.analysis.segments_loudness_max[h5.root.analysis.songs.cols.idx_segments_loudness_max[songidx]:],upcast)
+    return decode_array(h5.root.analysis.segments_loudness_max[h5.root.analysis.songs.cols.idx_segments_loudness_max[songidx]:
+                                                               h5.root.analysis.songs.cols.idx_segments_loudness_max[songidx+1]],upcast)
 
-def get_segments_loudness_max_time(h5,songidx=0):
+def get_segments_loudness_max_time(h5,songidx=0,upcast=False):
     """
     Get segments loudness max time array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_loudness_max_time[h5.root.analysis.songs.cols.idx_segments_loudness_max_time[songidx]:]
-    return h5.root.analysis.segments_loudness_max_time[h5.root.analysis.songs.cols.idx_segments_loudness_max_time[songidx]:
-                                                       h5.root.analysis.songs.cols.idx_segments_loudness_max_time[songidx+1]]
+        return decode_array(h5.root.analysis.segments_loudness_max_time[h5.root.analysis.songs.cols.idx_segments_loudness_max_time[songidx]:],upcast)
+    return decode_array(h5.root.analysis.segments_loudness_max_time[h5.root.analysis.songs.cols.idx_segments_loudness_max_time[songidx]:
+                                                                    h5.root.analysis.songs.cols.idx_segments_loudness_max_time[songidx+1]],upcast)
 
-def get_segments_loudness_start(h5,songidx=0):
+def get_segments_loudness_start(h5,songidx=0,upcast=False):
     """
     Get segments loudness start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.segments_loudness_start[h5.root.analysis.songs.cols.idx_segments_loudness_start[songidx]:]
-    return h5.root.analysis.segments_loudness_start[h5.root.analysis.songs.cols.idx_segments_loudness_start[songidx]:
-                                                    h5.root.analysis.songs.cols.idx_segments_loudness_start[songidx+1]]
+        return decode_array(h5.root.analysis.segments_loudness_start[h5.root.analysis.songs.cols.idx_segments_loudness_start[songidx]:],upcast)
+    return decode_array(h5.root.analysis.segments_loudness_start[h5.root.analysis.songs.cols.idx_segments_loudness_start[songidx]:
+                                                                 h5.root.analysis.songs.cols.idx_segments_loudness_start[songidx+1]],upcast)
 
-def get_sections_start(h5,songidx=0):
+def get_sections_start(h5,songidx=0,upcast=False):
     """
     Get sections start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.sections_start[h5.root.analysis.songs.cols.idx_sections_start[songidx]:]
-    return h5.root.analysis.sections_start[h5.root.analysis.songs.cols.idx_sections_start[songidx]:
-                                           h5.root.analysis.songs.cols.idx_sections_start[songidx+1]]
+        return decode_array(h5.root.analysis.sections_start[h5.root.analysis.songs.cols.idx_sections_start[songidx]:],upcast)
+    return decode_array(h5.root.analysis.sections_start[h5.root.analysis.songs.cols.idx_sections_start[songidx]:
+                                                        h5.root.analysis.songs.cols.idx_sections_start[songidx+1]],upcast)
 
-def get_sections_confidence(h5,songidx=0):
+def get_sections_confidence(h5,songidx=0,upcast=False):
     """
     Get sections confidence array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.sections_confidence[h5.root.analysis.songs.cols.idx_sections_confidence[songidx]:]
-    return h5.root.analysis.sections_confidence[h5.root.analysis.songs.cols.idx_sections_confidence[songidx]:
-                                                h5.root.analysis.songs.cols.idx_sections_confidence[songidx+1]]
+        return decode_array(h5.root.analysis.sections_confidence[h5.root.analysis.songs.cols.idx_sections_confidence[songidx]:],upcast)
+    return decode_array(h5.root.analysis.sections_confidence[h5.root.analysis.songs.cols.idx_sections_confidence[songidx]:
+                                                             h5.root.analysis.songs.cols.idx_sections_confidence[songidx+1]],upcast)
 
-def get_beats_start(h5,songidx=0):
+def get_beats_start(h5,songidx=0,upcast=False):
     """
     Get beats start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.beats_start[h5.root.analysis.songs.cols.idx_beats_start[songidx]:]
-    return h5.root.analysis.beats_start[h5.root.analysis.songs.cols.idx_beats_start[songidx]:
-                                        h5.root.analysis.songs.cols.idx_beats_start[songidx+1]]
+        return decode_array(h5.root.analysis.beats_start[h5.root.analysis.songs.cols.idx_beats_start[songidx]:],upcast)
+    return decode_array(h5.root.analysis.beats_start[h5.root.analysis.songs.cols.idx_beats_start[songidx]:
+                                                     h5.root.analysis.songs.cols.idx_beats_start[songidx+1]],upcast)
 
-def get_beats_confidence(h5,songidx=0):
+def get_beats_confidence(h5,songidx=0,upcast=False):
     """
     Get beats confidence array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.beats_confidence[h5.root.analysis.songs.cols.idx_beats_confidence[songidx]:]
-    return h5.root.analysis.beats_confidence[h5.root.analysis.songs.cols.idx_beats_confidence[songidx]:
-                                             h5.root.analysis.songs.cols.idx_beats_confidence[songidx+1]]
+        return decode_array(h5.root.analysis.beats_confidence[h5.root.analysis.songs.cols.idx_beats_confidence[songidx]:],upcast)
+    return decode_array(h5.root.analysis.beats_confidence[h5.root.analysis.songs.cols.idx_beats_confidence[songidx]:
+                                                          h5.root.analysis.songs.cols.idx_beats_confidence[songidx+1]],upcast)
 
-def get_bars_start(h5,songidx=0):
+def get_bars_start(h5,songidx=0,upcast=False):
     """
     Get bars start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.bars_start[h5.root.analysis.songs.cols.idx_bars_start[songidx]:]
-    return h5.root.analysis.bars_start[h5.root.analysis.songs.cols.idx_bars_start[songidx]:
-                                       h5.root.analysis.songs.cols.idx_bars_start[songidx+1]]
+        return decode_array(h5.root.analysis.bars_start[h5.root.analysis.songs.cols.idx_bars_start[songidx]:],upcast)
+    return decode_array(h5.root.analysis.bars_start[h5.root.analysis.songs.cols.idx_bars_start[songidx]:
+                                                    h5.root.analysis.songs.cols.idx_bars_start[songidx+1]],upcast)
 
-def get_bars_confidence(h5,songidx=0):
+def get_bars_confidence(h5,songidx=0,upcast=False):
     """
     Get bars start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.bars_confidence[h5.root.analysis.songs.cols.idx_bars_confidence[songidx]:]
-    return h5.root.analysis.bars_confidence[h5.root.analysis.songs.cols.idx_bars_confidence[songidx]:
-                                            h5.root.analysis.songs.cols.idx_bars_confidence[songidx+1]]
+        return decode_array(h5.root.analysis.bars_confidence[h5.root.analysis.songs.cols.idx_bars_confidence[songidx]:],upcast)
+    return decode_array(h5.root.analysis.bars_confidence[h5.root.analysis.songs.cols.idx_bars_confidence[songidx]:
+                                                         h5.root.analysis.songs.cols.idx_bars_confidence[songidx+1]],upcast)
 
-def get_tatums_start(h5,songidx=0):
+def get_tatums_start(h5,songidx=0,upcast=False):
     """
     Get tatums start array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.tatums_start[h5.root.analysis.songs.cols.idx_tatums_start[songidx]:]
-    return h5.root.analysis.tatums_start[h5.root.analysis.songs.cols.idx_tatums_start[songidx]:
-                                         h5.root.analysis.songs.cols.idx_tatums_start[songidx+1]]
+        return decode_array(h5.root.analysis.tatums_start[h5.root.analysis.songs.cols.idx_tatums_start[songidx]:],upcast)
+    return decode_array(h5.root.analysis.tatums_start[h5.root.analysis.songs.cols.idx_tatums_start[songidx]:
+                                                      h5.root.analysis.songs.cols.idx_tatums_start[songidx+1]],upcast)
 
-def get_tatums_confidence(h5,songidx=0):
+def get_tatums_confidence(h5,songidx=0,upcast=False):
     """
     Get tatums confidence array. Takes care of the proper indexing if we are in aggregate
     file. By default, return the array for the first song in the h5 file.
     To get a regular numpy ndarray, cast the result to: numpy.array( )
+    If upcast, reduced precision arrays (e.g. float32) are returned as float64.
     """
     if h5.root.analysis.songs.nrows == songidx + 1:
-        return h5.root.analysis.tatums_confidence[h5.root.analysis.songs.cols.idx_tatums_confidence[songidx]:]
-    return h5.root.analysis.tatums_confidence[h5.root.analysis.songs.cols.idx_tatums_confidence[songidx]:
-                                              h5.root.analysis.songs.cols.idx_tatums_confidence[songidx+1]]
+        return decode_array(h5.root.analysis.tatums_confidence[h5.root.analysis.songs.cols.idx_tatums_confidence[songidx]:],upcast)
+    return decode_array(h5.root.analysis.tatums_confidence[h5.root.analysis.songs.cols.idx_tatums_confidence[songidx]:
+                                                           h5.root.analysis.songs.cols.idx_tatums_confidence[songidx+1]],upcast)
 
 def get_artist_mbtags(h5,songidx=0):
     """
@@ -474,3 +687,261 @@ def get_year(h5,songidx=0):
     Get release year from a HDF5 song file, by default the first song in it
     """
     return h5.root.musicbrainz.songs.cols.year[songidx]
+
+
+def read_fields(h5,fields,songidx=None):
+    """
+    Get many fields (e.g. ['tempo','year','artist_id']) for many songs
+    at once. Each table holding some of the fields is read once, with a
+    single bulk read, instead of one read per field per song with the
+    regular getters, which makes it much faster to scan a summary /
+    aggregate file.
+    Only works for fields with one value per song (tables columns), not
+    for arrays like segments_start.
+    INPUT
+       h5       - open h5 file
+       fields   - list of field names, or one field name
+       songidx  - None (all songs), one index, a slice, or a list / array
+                  of indices (coordinates), negative indices count
+                  from the end
+    RETURN
+       numpy structured array, one row per song, e.g. res['tempo']
+       (one record if songidx is a single index)
+    """
+    if type(fields).__name__ == 'str':
+        fields = [fields]
+    # find the table containing each field, songs tables first
+    alltables = [h5.getNode('/'+group,'songs') for group in SONG_TABLES]
+    artists = None
+    if 'artists' in h5.root.metadata._v_children:
+        artists = h5.root.metadata.artists
+        alltables.append(artists)
+    field_tables = []
+    for field in fields:
+        for table in alltables:
+            if field in table.colnames:
+                field_tables.append(table)
+                break
+        else:
+            raise ValueError('unknown field: '+str(field))
+    # songs we read, as a slice or as coordinates
+    nSongs = get_num_songs(h5)
+    single = False
+    coords = None
+    if songidx is None:
+        songidx = slice(0,nSongs)
+    elif isinstance(songidx,(int,long,np.integer)):
+        single = True
+        if songidx < 0:
+            songidx += nSongs
+        if songidx < 0 or songidx >= nSongs:
+            raise IndexError('song index out of range: '+str(songidx))
+        songidx = slice(songidx,songidx+1)
+    elif not isinstance(songidx,slice):
+        coords = np.array(songidx,dtype='int64').reshape(-1)
+        coords[coords < 0] += nSongs
+    if coords is None:
+        start,stop,step = songidx.indices(nSongs)
+    # one read per table, the artist of each song is in metadata
+    readtables = [table for table in alltables if table in field_tables]
+    if artists in readtables and not h5.root.metadata.songs in readtables:
+        readtables.append(h5.root.metadata.songs)
+    rows = {}
+    for table in readtables:
+        if table is artists:
+            continue
+        if coords is None:
+            rows[table._v_pathname] = table.read(start,stop,step)
+        else:
+            rows[table._v_pathname] = table.readCoordinates(coords)
+    # artist fields, we read the artist of each song
+    if artists in readtables:
+        artistrows = rows[h5.root.metadata.songs._v_pathname]['artist_row']
+        uniquerows,inverse = np.unique(artistrows,return_inverse=True)
+        rows[artists._v_pathname] = artists.readCoordinates(uniquerows.astype('int64'))[inverse]
+    # put everything in one structured array
+    columns = [rows[table._v_pathname][field] for field,table in zip(fields,field_tables)]
+    nrows = columns[0].shape[0] if len(columns) > 0 else 0
+    res = np.zeros(nrows,dtype=[(f,c.dtype,c.shape[1:]) for f,c in zip(fields,columns)])
+    for field,col in zip(fields,columns):
+        res[field] = col
+    if single:
+        return res[0]
+    return res
+
+
+def read_rows(h5,start=0,stop=None,fields=None):
+    """
+    Get songs start to stop-1 with the fields of all tables (metadata,
+    analysis, musicbrainz, and artists if any) joined in one numpy
+    structured array. Each table is read once, see read_fields.
+    INPUT
+       h5       - open h5 file
+       start    - first song
+       stop     - last song plus one, default is the end of the file
+       fields   - list of field names, default is all fields that have
+                  a getter and are in the tables (i.e. no arrays)
+    RETURN
+       numpy structured array, one row per song, e.g. res['tempo']
+    """
+    if fields is None:
+        fields = []
+        tables = [h5.getNode('/'+group,'songs') for group in SONG_TABLES]
+        if 'artists' in h5.root.metadata._v_children:
+            tables.append(h5.root.metadata.artists)
+        for table in tables:
+            for field in table.colnames:
+                if 'get_'+field in globals() and not field in fields:
+                    fields.append(field)
+    return read_fields(h5,fields,slice(start,stop))
+
+
+def iter_rows(h5,fields=None,chunksize=10000):
+    """
+    Iterate over all songs of a file, chunksize songs at a time,
+    see read_rows. Each step is one structured array.
+    USAGE
+       for rows in iter_rows(h5,['artist_name','tempo','year']):
+           print rows['tempo'][rows['year'] > 2000].mean()
+    """
+    nSongs = get_num_songs(h5)
+    for start in xrange(0,nSongs,chunksize):
+        yield read_rows(h5,start,min(start+chunksize,nSongs),fields)
+
+
+def read_song(h5,songidx=0):
+    """
+    Get all the fields of one song in a single pass over the file,
+    by default the first song in it.
+    Each songs table is read once, each array once, instead of one
+    read per getter (three for arrays).
+    Arrays that are not in the file (e.g. summary file) are skipped.
+    A negative songidx counts from the end, like read_fields.
+    RETURN
+       dictionary field -> value, fields are named like the getters
+       without 'get_', e.g. 'artist_name' or 'segments_start'
+    """
+    nSongs = get_num_songs(h5)
+    if songidx < 0:
+        songidx += nSongs
+    if songidx < 0 or songidx >= nSongs:
+        raise IndexError('song index out of range: '+str(songidx))
+    song = {}
+    rows = {}
+    for group in SONG_TABLES:
+        table = h5.getNode('/'+group,'songs')
+        # this song and the next one, the next tells us where arrays stop
+        rows[group] = table.read(songidx,songidx+2)
+        for field in table.colnames:
+            # only fields that have a getter
+            if 'get_'+field in globals():
+                song[field] = rows[group][field][0]
+    # artist of the song and the next artist, if there is an artists table
+    if 'artists' in h5.root.metadata._v_children:
+        row = rows['metadata']['artist_row'][0]
+        rows['artists'] = h5.root.metadata.artists.read(row,row+2)
+        for field in h5.root.metadata.artists.colnames:
+            if 'get_'+field in globals():
+                song[field] = rows['artists'][field][0]
+    for name,(group,idxcol) in ARRAY_INDICES.items():
+        groupnode = h5.getNode('/'+group)
+        if not name in groupnode._v_children:
+            continue
+        array = groupnode._v_children[name]
+        idxrows = rows[group]
+        if not idxcol in idxrows.dtype.names:
+            idxrows = rows['artists']
+        start = idxrows[idxcol][0]
+        if idxrows.shape[0] > 1:
+            stop = idxrows[idxcol][1]
+        else: # last song (or artist)
+            stop = array.shape[0]
+        song[name] = decode_array(decode_strings(array,array[start:stop]),name=name)
+    return song
+
+
+def find_songidx(h5,track_id):
+    """
+    Find the index of a song in an aggregate / summary file from its
+    track id, e.g. 'TRAAAAW128F429D538'. Returns -1 if it is not there.
+    If the file has a track id index (see create_track_id_index in
+    hdf5_utils), it is a binary search reading a few values, otherwise
+    the whole track_id column is read.
+    """
+    group = h5.root.analysis
+    if not 'track_id_index' in group._v_children:
+        res = np.where(group.songs.read(field='track_id') == track_id)[0]
+        if res.shape[0] == 0:
+            return -1
+        return int(res[0])
+    index = group.track_id_index
+    low = 0
+    high = index.nrows
+    while low < high:
+        mid = (low + high) // 2
+        if index.cols.track_id[mid] < track_id:
+            low = mid + 1
+        else:
+            high = mid
+    if low < index.nrows and index.cols.track_id[low] == track_id:
+        return int(index.cols.songidx[low])
+    return -1
+
+
+class ArrayIndex(object):
+    """
+    Index of the arrays (segments_start, artist_terms, ...) of an open
+    aggregate file. All idx_* columns are loaded once in memory, with the
+    length of the array appended at the end, so getting the part of an
+    array that belongs to one song does not require any table read.
+    Useful when we get many arrays from many songs of the same file.
+    Arrays that are not in the file (e.g. summary file) are skipped.
+    Arrays stored per artist (see ARTIST_ARRAYS) have offsets per artist,
+    self.rows[name] gives the artist of each song.
+    USAGE
+       aidx = ArrayIndex(h5)
+       timbre = aidx.get_array('segments_timbre',songidx)
+    """
+    def __init__(self,h5):
+        self.h5 = h5
+        self.arrays = {}
+        self.offsets = {}
+        self.rows = {}
+        idxcols = {}
+        for name,(group,idxcol) in ARRAY_INDICES.items():
+            group = h5.getNode('/'+group)
+            if not name in group._v_children:
+                continue
+            array = group._v_children[name]
+            # index in the artists table, one row per artist
+            table = group.songs
+            if not idxcol in table.colnames:
+                table = group.artists
+                if not 'artist_row' in idxcols:
+                    idxcols['artist_row'] = group.songs.read(field='artist_row').astype('int64')
+                self.rows[name] = idxcols['artist_row']
+            if not idxcol in idxcols:
+                idxcols[idxcol] = table.read(field=idxcol).astype('int64')
+            self.arrays[name] = array
+            self.offsets[name] = np.concatenate((idxcols[idxcol],[array.shape[0]])).astype('int64')
+
+    def get_bounds(self,name,songidx=0):
+        """
+        Return (start,stop) of the given song in the given array
+        """
+        if name in self.rows:
+            songidx = self.rows[name][songidx]
+        offsets = self.offsets[name]
+        return offsets[songidx],offsets[songidx+1]
+
+    def get_array(self,name,songidx=0,upcast=False):
+        """
+        Return the part of the given array (e.g. 'segments_start')
+        that belongs to the given song, as a numpy array
+        If upcast, reduced precision arrays are returned as float64.
+        Strings stored as codes are decoded, self.arrays[name] gives
+        the codes (see read_vocab).
+        """
+        start,stop = self.get_bounds(name,songidx)
+        data = self.arrays[name][start:stop]
+        return decode_array(decode_strings(self.arrays[name],data),upcast,name=name)
@@ -0,0 +1,222 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+This code selects songs in a summary file (or aggregate file) from
+simple conditions on their fields, e.g. 'year > 0' and 'tempo > 120'.
+Conditions are evaluated inside PyTables (numexpr, Table.getWhereList)
+instead of looping over the songs in Python, columns that are filtered
+often can be indexed, so selecting among a million songs is fast.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import re
+import time
+import datetime
+import numpy as np
+import tables
+import hdf5_getters as GETTERS
+
+
+def query_tables(h5):
+    """
+    Tables we can put conditions on: the three songs tables, and the
+    artists table if there is one (see artist_table in hdf5_utils)
+    """
+    res = [h5.getNode('/'+group,'songs') for group in GETTERS.SONG_TABLES]
+    if 'artists' in h5.root.metadata._v_children:
+        res.append(h5.root.metadata.artists)
+    return res
+
+
+def condition_table(h5,condition):
+    """
+    Find the table holding the columns used in a condition, e.g.
+    'tempo > 120' -> /analysis/songs. All columns must be in the same table.
+    Raise a ValueError otherwise.
+    """
+    names = condition_colnames(h5,condition)
+    if len(names) == 0:
+        raise ValueError('condition uses no known column: '+condition)
+    for table in query_tables(h5):
+        if names.issubset(table.colnames):
+            return table
+    raise ValueError('condition uses columns from many tables: '+condition)
+
+
+def condition_colnames(h5,condition):
+    """
+    Set of the columns used in a condition
+    """
+    return set(re.findall(r'[A-Za-z_][A-Za-z0-9_]*',condition)).intersection(all_colnames(h5))
+
+
+def all_colnames(h5):
+    """
+    Names of all the columns we can put conditions on
+    """
+    res = set()
+    for table in query_tables(h5):
+        res.update(table.colnames)
+    return res
+
+
+def count_query(table,colnames,autoindex):
+    """
+    Count how many times we filtered on these columns (in the table
+    attributes), and index the ones filtered at least autoindex times.
+    The file must be open in append mode.
+    """
+    attrs = table.attrs
+    counts = {}
+    if 'query_counts' in attrs._v_attrnames:
+        counts = attrs.query_counts
+    for colname in colnames:
+        counts[colname] = counts.get(colname,0) + 1
+        col = getattr(table.cols,colname)
+        if counts[colname] >= autoindex and not col.is_indexed:
+            col.createIndex()
+    attrs.query_counts = counts
+
+
+def select_songs(h5,conditions,fields=None,autoindex=None):
+    """
+    Select the songs of an open summary / aggregate file that satisfy
+    all conditions. Conditions on the same table are merged and evaluated
+    in one pass inside PyTables, using column indexes if they exist.
+    INPUT
+       h5          - open summary or aggregate file
+       conditions  - one condition or a list of them, in numexpr syntax,
+                     each on the columns of one table, e.g.
+                     ['year > 0','(tempo > 120) & (mode == 1)']
+       fields      - if given, also return these fields for the selected
+                     songs, see read_fields in hdf5_getters
+       autoindex   - if given (and file open in append mode), columns that
+                     have been filtered at least that many times get an
+                     index, which makes the next queries faster
+    RETURN
+       sorted array of song indices, or the structured array of the
+       fields for these songs if fields is given
+    """
+    if type(conditions).__name__ == 'str':
+        conditions = [conditions]
+    # merge conditions per table
+    table_conds = {}
+    tables_by_path = {}
+    for condition in conditions:
+        table = condition_table(h5,condition)
+        table_conds.setdefault(table._v_pathname,[]).append('('+condition+')')
+        tables_by_path[table._v_pathname] = table
+    # evaluate them, one table at a time
+    songidxs = None
+    for path,conds in table_conds.items():
+        table = tables_by_path[path]
+        condition = ' & '.join(conds)
+        if autoindex is not None:
+            count_query(table,condition_colnames(h5,condition),autoindex)
+        coords = table.getWhereList(condition)
+        if table._v_name == 'artists':
+            # from artists to their songs
+            artist_rows = h5.root.metadata.songs.read(field='artist_row')
+            coords = np.where(np.in1d(artist_rows,coords))[0]
+        if songidxs is None:
+            songidxs = coords
+        else:
+            songidxs = np.intersect1d(songidxs,coords)
+    if songidxs is None: # no conditions, all songs
+        songidxs = np.arange(GETTERS.get_num_songs(h5))
+    songidxs = np.sort(songidxs).astype('int64')
+    if fields is not None:
+        if songidxs.shape[0] == 0:
+            return GETTERS.read_fields(h5,fields,slice(0,0))
+        return GETTERS.read_fields(h5,fields,songidxs)
+    return songidxs
+
+
+def die_with_usage():
+    """ HELP MENU """
+    print 'hdf5_query.py'
+    print '   by T. Bertin-Mahieux (2011) Columbia University'
+    print '   tb2332@columbia.edu'
+    print ''
+    print 'Select songs in a summary (or aggregate) file, see select_songs.'
+    print 'Conditions use numexpr syntax, columns named like the getters.'
+    print ''
+    print 'usage:'
+    print '   python hdf5_query.py [FLAGS] <H5 FILE> <condition1> <condition2> ...'
+    print 'example:'
+    print "   python hdf5_query.py -fields artist_name,title summary.h5 'year > 0' 'tempo > 120'"
+    print 'PARAMS'
+    print '   H5 FILE    - summary or aggregate file'
+    print '   condition  - e.g. "year > 0", songs must satisfy all of them'
+    print 'FLAGS'
+    print '   -fields F     - comma-separated fields to print for each song,'
+    print '                   default is track_id'
+    print '   -autoindex N  - index columns once they are filtered N times'
+    print '                   (the file is then open in append mode)'
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+
+    # help menu
+    if len(sys.argv) < 3:
+        die_with_usage()
+
+    # flags
+    fields = ['track_id']
+    autoindex = None
+    while True:
+        if sys.argv[1] == '-fields':
+            fields = sys.argv[2].split(',')
+            sys.argv.pop(1)
+        elif sys.argv[1] == '-autoindex':
+            autoindex = int(sys.argv[2])
+            sys.argv.pop(1)
+        else:
+            break
+        sys.argv.pop(1)
+
+    # params
+    h5filename = sys.argv[1]
+    conditions = sys.argv[2:]
+
+    # sanity checks
+    if not os.path.isfile(h5filename):
+        print 'ERROR: file',h5filename,'does not exist.'
+        sys.exit(0)
+
+    # query
+    t1 = time.time()
+    if autoindex is None:
+        h5 = GETTERS.open_h5_file_read(h5filename)
+    else:
+        h5 = tables.openFile(h5filename,mode='a')
+    try:
+        res = select_songs(h5,conditions,fields=fields,autoindex=autoindex)
+    finally:
+        h5.close()
+    for row in res:
+        print '\t'.join([str(row[field]) for field in fields])
+    stimelength = str(datetime.timedelta(seconds=time.time()-t1))
+    print 'found',res.shape[0],'songs in:',stimelength
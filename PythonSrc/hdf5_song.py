@@ -0,0 +1,89 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+This code contains a small object to access all the fields of one
+song in an open HDF5 file (song file or aggregate / summary file).
+Fields are read the first time they are asked for, then kept, so
+many feature extractors can share one song without reading the same
+data twice.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hdf5_getters as GETTERS
+
+
+# all fields we know of, one per getter, e.g. 'artist_name'
+FIELDS = tuple(sorted([x[4:] for x in GETTERS.__dict__.keys()
+                       if x[:4] == 'get_' and x != 'get_num_songs']))
+
+
+class Song(object):
+    """
+    One song in an open HDF5 file. Every field is an attribute,
+    e.g. song.tempo or song.segments_timbre, read the first time
+    it is accessed and memoized afterwards.
+    If an ArrayIndex (from hdf5_getters) is given for aggregate files,
+    arrays are read through it, i.e. without reading the idx_* columns.
+    The h5 file is not closed by the song, it belongs to the caller.
+    USAGE
+       h5 = hdf5_getters.open_h5_file_read(path)
+       song = Song(h5)
+       print song.artist_name, song.segments_pitches.shape
+    """
+    # one slot per field, empty until the field is read
+    __slots__ = ('h5','songidx','arrayindex') + FIELDS
+
+    def __init__(self,h5,songidx=0,arrayindex=None):
+        self.h5 = h5
+        self.songidx = songidx
+        self.arrayindex = arrayindex
+
+    def __getattr__(self,name):
+        """
+        Called only when the slot is empty: read the field and keep it
+        """
+        if not name in FIELDS:
+            raise AttributeError("'Song' object has no attribute '"+name+"'")
+        if self.arrayindex is not None and name in self.arrayindex.arrays:
+            value = self.arrayindex.get_array(name,self.songidx)
+        else:
+            getter = getattr(GETTERS,'get_'+name,None)
+            if getter is None:
+                raise AttributeError("'Song' object has no attribute '"+name+"'")
+            value = getter(self.h5,self.songidx)
+        setattr(self,name,value)
+        return value
+
+    def load(self,fields=FIELDS):
+        """
+        Read all given fields now (all of them by default),
+        useful before closing the h5 file
+        """
+        for field in fields:
+            getattr(self,field)
+
+    def to_dict(self,fields=FIELDS):
+        """
+        Return a dictionary field -> value for the given fields
+        (all of them by default)
+        """
+        return dict([(field,getattr(self,field)) for field in fields])
@@ -0,0 +1,275 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+This code exports song files (or aggregate files) to flat binary
+column files, one file per field, e.g. tempo.f8 or segments_timbre.f8,
+plus one offsets file per array, e.g. segments_timbre.offsets.i8.
+Column files can then be memory-mapped with numpy, getting the data
+of one song is a simple offset in a file instead of opening an HDF5 file.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import datetime
+import json
+import numpy as np
+# project code
+import hdf5_getters as GETTERS
+import utils
+
+
+# description of the columns, in the output directory
+MANIFEST = 'columns.json'
+
+
+def column_filename(field,dtype):
+    """
+    Filename of a column, the field plus its numpy type,
+    e.g. tempo.f8 or track_id.S32
+    """
+    return field + '.' + np.dtype(dtype).str.lstrip('<>|=')
+
+
+def offsets_filename(field):
+    """
+    Filename of the offsets of an array, e.g. segments_timbre.offsets.i8
+    """
+    return field + '.offsets.i8'
+
+
+def default_fields(h5):
+    """
+    All fields that have a getter and exist in that file, i.e.
+    no arrays if it is a summary file
+    """
+    fields = []
+    for group in GETTERS.SONG_TABLES:
+        table = h5.getNode('/'+group,'songs')
+        fields.extend( filter(lambda f: 'get_'+f in GETTERS.__dict__,table.colnames) )
+    if 'artists' in h5.root.metadata._v_children:
+        table = h5.root.metadata.artists
+        fields.extend( filter(lambda f: 'get_'+f in GETTERS.__dict__ and not f in fields,table.colnames) )
+    for name,(group,idxcol) in sorted(GETTERS.ARRAY_INDICES.items()):
+        if name in h5.getNode('/'+group)._v_children:
+            fields.append(name)
+    return fields
+
+
+def transfer(h5filenames,outdir,fields=None,verbose=False):
+    """
+    Export all songs of the given HDF5 files to column files in outdir.
+    Songs are numbered in the order of the files.
+    INPUT
+       h5filenames  - list of song files or aggregate files
+       outdir       - output directory, created if needed, its column
+                      files are overwritten
+       fields       - fields to export, all of them by default
+    RETURN
+       number of songs exported
+    NOTE
+       string columns keep the width they have in the HDF5 tables,
+       e.g. 1024 for artist_name, export only the fields you need!
+       Arrays are decoded (see decode_array in hdf5_getters) and
+       written in the type they have in the first file.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    manifest = {'nsongs':0,'columns':{},'arrays':{}}
+    colfiles = {}
+    arrayfiles = {}
+    offsetfiles = {}
+    arraylens = {}
+    try:
+        for filecnt,h5filename in enumerate(h5filenames):
+            h5 = GETTERS.open_h5_file_read(h5filename)
+            try:
+                if fields is None:
+                    fields = default_fields(h5)
+                tablefields = filter(lambda f: not f in GETTERS.ARRAY_INDICES,fields)
+                arrayfields = filter(lambda f: f in GETTERS.ARRAY_INDICES,fields)
+                # one value per song
+                if len(tablefields) > 0:
+                    rows = GETTERS.read_fields(h5,tablefields)
+                    for field in tablefields:
+                        if not field in colfiles:
+                            dtype = rows.dtype[field]
+                            manifest['columns'][field] = {'dtype':dtype.str,
+                                                          'filename':column_filename(field,dtype)}
+                            colfiles[field] = open(os.path.join(outdir,column_filename(field,dtype)),'wb')
+                        dtype = np.dtype(str(manifest['columns'][field]['dtype']))
+                        rows[field].astype(dtype).tofile(colfiles[field])
+                # arrays, all the songs of that file at once
+                if len(arrayfields) > 0:
+                    arrayindex = GETTERS.ArrayIndex(h5)
+                for field in arrayfields:
+                    if not field in arrayindex.arrays:
+                        raise ValueError('no array '+field+' in file '+h5filename)
+                    if field in arrayindex.rows:
+                        # stored per artist, we copy it for each song
+                        parts = [arrayindex.get_array(field,songidx)
+                                 for songidx in xrange(arrayindex.rows[field].shape[0])]
+                        data = np.concatenate(parts)
+                        offsets = np.cumsum([0]+[part.shape[0] for part in parts]).astype('int64')
+                    else:
+                        offsets = arrayindex.offsets[field]
+                        data = arrayindex.arrays[field][offsets[0]:offsets[-1]]
+                        data = GETTERS.decode_strings(arrayindex.arrays[field],data)
+                        data = GETTERS.decode_array(data,name=field)
+                    if not field in arrayfiles:
+                        manifest['arrays'][field] = {'dtype':data.dtype.str,
+                                                     'shape':list(data.shape[1:]),
+                                                     'filename':column_filename(field,data.dtype),
+                                                     'offsets':offsets_filename(field)}
+                        arrayfiles[field] = open(os.path.join(outdir,column_filename(field,data.dtype)),'wb')
+                        offsetfiles[field] = open(os.path.join(outdir,offsets_filename(field)),'wb')
+                        arraylens[field] = 0
+                    # files can differ in precision (see -precision in
+                    # create_aggregate_file), the first one sets the type
+                    data = data.astype(np.dtype(str(manifest['arrays'][field]['dtype'])))
+                    data.tofile(arrayfiles[field])
+                    (offsets[:-1] - offsets[0] + arraylens[field]).tofile(offsetfiles[field])
+                    arraylens[field] += data.shape[0]
+                manifest['nsongs'] += GETTERS.get_num_songs(h5)
+            finally:
+                h5.close()
+            if verbose and filecnt % 1000 == 0:
+                print 'exported',filecnt,'files out of',len(h5filenames)
+        # last offset, end of the last song
+        for field in offsetfiles.keys():
+            np.array([arraylens[field]],dtype='int64').tofile(offsetfiles[field])
+    finally:
+        for f in colfiles.values() + arrayfiles.values() + offsetfiles.values():
+            f.close()
+    # describe what we wrote
+    f = open(os.path.join(outdir,MANIFEST),'w')
+    json.dump(manifest,f,indent=1,sort_keys=True)
+    f.close()
+    return manifest['nsongs']
+
+
+def memmap_file(path,dtype,shape):
+    """
+    Memory-map a column file, read-only. numpy can not map
+    empty files, we return an empty array in that case.
+    """
+    if os.path.getsize(path) == 0:
+        return np.zeros([0]+list(shape),dtype=dtype)
+    return np.memmap(path,dtype=dtype,mode='r').reshape([-1]+list(shape))
+
+
+class ColumnStore(object):
+    """
+    Read-only access to a directory created by transfer.
+    Every column is memory-mapped, nothing is read until used.
+    USAGE
+       cs = ColumnStore(outdir)
+       tempos = cs.get_column('tempo')   # all songs
+       timbre = cs.get_array('segments_timbre',songidx)
+    """
+    def __init__(self,outdir):
+        self.outdir = outdir
+        f = open(os.path.join(outdir,MANIFEST),'r')
+        self.manifest = json.load(f)
+        f.close()
+        self.nsongs = self.manifest['nsongs']
+        self.columns = {}
+        for field,desc in self.manifest['columns'].items():
+            self.columns[field] = memmap_file(os.path.join(outdir,desc['filename']),
+                                              np.dtype(str(desc['dtype'])),[])
+        self.arrays = {}
+        self.offsets = {}
+        for field,desc in self.manifest['arrays'].items():
+            self.arrays[field] = memmap_file(os.path.join(outdir,desc['filename']),
+                                             np.dtype(str(desc['dtype'])),desc['shape'])
+            self.offsets[field] = memmap_file(os.path.join(outdir,desc['offsets']),
+                                              np.dtype('int64'),[])
+
+    def get_column(self,field):
+        """
+        Memory-mapped column, one value per song
+        """
+        return self.columns[field]
+
+    def get_value(self,field,songidx=0):
+        """
+        Value of a one-value-per-song field for one song
+        """
+        return self.columns[field][songidx]
+
+    def get_array(self,field,songidx=0):
+        """
+        Part of an array belonging to one song, no copy
+        """
+        offsets = self.offsets[field]
+        return self.arrays[field][offsets[songidx]:offsets[songidx+1]]
+
+
+def die_with_usage():
+    """ HELP MENU """
+    print 'hdf5_to_columns.py'
+    print '   by T. Bertin-Mahieux (2011) Columbia University'
+    print '   tb2332@columbia.edu'
+    print ''
+    print 'Export song files to flat binary column files, one per field,'
+    print 'that can be memory-mapped (see ColumnStore).'
+    print ''
+    print 'usage:'
+    print '   python hdf5_to_columns.py <H5 DIR/FILE> <OUTPUT DIR> <field1> <field2> ...'
+    print 'PARAMS'
+    print '   H5 DIR/FILE  - directory contains h5 files (subdirs are checked)'
+    print '                  or one aggregate / summary file'
+    print '   OUTPUT DIR   - where to put the column files'
+    print '   field        - e.g. track_id tempo segments_timbre,'
+    print '                  all fields if none given'
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+
+    # help menu
+    if len(sys.argv) < 3:
+        die_with_usage()
+
+    # params
+    inpath = sys.argv[1]
+    outdir = sys.argv[2]
+    fields = sys.argv[3:]
+    if len(fields) == 0:
+        fields = None
+
+    # sanity checks
+    if os.path.isfile(inpath):
+        allh5 = [inpath]
+    elif os.path.isdir(inpath):
+        allh5 = sorted(utils.get_all_files(inpath,ext='.h5'))
+    else:
+        print 'ERROR: file or dir',inpath,'does not exists.'
+        sys.exit(0)
+    print 'found',len(allh5),'H5 files.'
+
+    # export
+    t1 = time.time()
+    nsongs = transfer(allh5,outdir,fields=fields,verbose=True)
+    stimelength = str(datetime.timedelta(seconds=time.time()-t1))
+    print 'Exported',nsongs,'songs in:',stimelength
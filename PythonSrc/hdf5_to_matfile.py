@@ -76,11 +76,6 @@ def transfer(h5path,matpath=None,force=False):
         else:
             print 'matfile',matpath,'already exists (delete or force):'
             return False
-    # get all getters! we assume that all we need is in hdf5_getters.py
-    # further assume that they have the form get_blablabla and that's the
-    # only thing that has that form
-    getters = filter(lambda x: x[:4] == 'get_', hdf5_getters.__dict__.keys())
-    getters.remove("get_num_songs") # special case
     # open h5 file
     h5 = hdf5_getters.open_h5_file_read(h5path)
     # transfer
@@ -89,13 +84,12 @@ def transfer(h5path,matpath=None,force=False):
     try:
         # iterate over songs
         for songidx in xrange(nSongs):
-            # iterate over getter
-            for getter in getters:
-                gettername = getter[4:]
+            # all fields of that song at once, same names as the getters
+            songdata = hdf5_getters.read_song(h5,songidx)
+            for fieldname,data in songdata.items():
                 if nSongs > 1:
-                    gettername += str(songidx+1)
-                data = hdf5_getters.__getattribute__(getter)(h5,songidx)
-                matdata[gettername] = data
+                    fieldname += str(songidx+1)
+                matdata[fieldname] = data
     except MemoryError:
         print 'Memory Error with file:',h5path
         print 'All data has to be loaded in memory before being saved as matfile'
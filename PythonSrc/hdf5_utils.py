@@ -45,6 +45,8 @@ except ImportError:
 # description of the different arrays in the song file
 ARRAY_DESC_SIMILAR_ARTISTS = 'array of similar artists Echo Nest id'
 ARRAY_DESC_ARTIST_TERMS = 'array of terms (Echo Nest tags) for an artist'
+ARRAY_DESC_SIMILAR_ARTISTS_VOCAB = 'all similar artists Echo Nest ids, similar_artists are codes in it'
+ARRAY_DESC_ARTIST_TERMS_VOCAB = 'all terms, artist_terms are codes in it'
 ARRAY_DESC_ARTIST_TERMS_FREQ = 'array of term (Echo Nest tags) frequencies for an artist'
 ARRAY_DESC_ARTIST_TERMS_WEIGHT = 'array of term (Echo Nest tags) weights for an artist'
 ARRAY_DESC_SEGMENTS_START = 'array of start times of segments'
@@ -65,6 +67,36 @@ ARRAY_DESC_TATUMS_CONFIDENCE = 'array of confidence of tatums'
 ARRAY_DESC_ARTIST_MBTAGS = 'array of tags from MusicBrainz for an artist'
 ARRAY_DESC_ARTIST_MBTAGS_COUNT = 'array of tag counts from MusicBrainz for an artist'
 
+# storage profiles for aggregate files, see create_aggregate_file
+# chunksongs is the number of songs per chunk in the arrays,
+# None lets pytables decide from the expected number of rows
+STORAGE_PROFILES = {'default':{'complib':'zlib','complevel':1,'shuffle':True,'chunksongs':None},
+                    'fastread':{'complib':'blosc','complevel':5,'shuffle':True,'chunksongs':1},
+                    'archive':{'complib':'zlib','complevel':9,'shuffle':True,'chunksongs':16},
+                    'nocompression':{'complib':'zlib','complevel':0,'shuffle':False,'chunksongs':4}}
+
+# estimated number of rows per song in the arrays, see create_all_arrays
+# arrays not listed (segments, beats, ...) use segments_per_song
+ROWS_PER_SONG = {'similar_artists':100,'artist_terms':40,'artist_terms_freq':40,
+                 'artist_terms_weight':40,'artist_mbtags':5,'artist_mbtags_count':5}
+
+# types the analysis arrays can be stored in, see create_all_arrays
+# uint8 only for segments_pitches (quantized, see encode_array)
+ARRAY_PRECISIONS = ('float16','float32','float64')
+PITCHES_PRECISIONS = ARRAY_PRECISIONS + ('uint8',)
+
+
+def encode_array(h5array,data):
+    """
+    Put data in the type of an existing array before appending it.
+    Only does something for pitches stored as uint8 (see create_all_arrays),
+    they are quantized, other types are converted by pytables.
+    """
+    if (h5array._v_name == 'segments_pitches' and h5array.atom.dtype == np.uint8
+        and np.asarray(data).dtype != np.uint8):
+        data = np.round(np.clip(data,0.,1.) * PITCHES_UINT8_SCALE).astype('uint8')
+    return data
+
 
 def fill_hdf5_from_artist(h5,artist):
     """
@@ -157,7 +189,8 @@ def fill_hdf5_from_track(h5,track):
     analysis.cols.idx_segments_confidence[0] = 0
     group.segments_confidence.append( np.array(map(lambda x : x['confidence'],track.segments),dtype='float64') )
     analysis.cols.idx_segments_pitches[0] = 0
-    group.segments_pitches.append( np.array(map(lambda x : x['pitches'],track.segments),dtype='float64') )
+    group.segments_pitches.append( encode_array(group.segments_pitches,
+                                                np.array(map(lambda x : x['pitches'],track.segments),dtype='float64')) )
     analysis.cols.idx_segments_timbre[0] = 0
     group.segments_timbre.append( np.array(map(lambda x : x['timbre'],track.segments),dtype='float64') )
     analysis.cols.idx_segments_loudness_max[0] = 0
@@ -217,7 +250,352 @@ def fill_hdf5_from_musicbrainz(h5,connect):
     musicbrainz.flush()
 
 
-def fill_hdf5_aggregate_file(h5,h5_filenames,summaryfile=False):
+def read_array_parts(array,starts,stops):
+    """
+    Concatenation of array[start:stop] for the given starts and stops,
+    the whole range is read at once unless the parts are too far apart
+    """
+    if starts.shape[0] == 0:
+        return array[0:0]
+    lens = stops - starts
+    low = starts.min()
+    high = stops.max()
+    if high - low > 10 * lens.sum() + 1000:
+        return np.concatenate([array[start:stop] for start,stop in zip(starts,stops)])
+    data = array[low:high]
+    if np.all(starts[1:] == stops[:-1]):
+        return data[starts[0]-low:stops[-1]-low]
+    idx = np.repeat(starts - low - (np.cumsum(lens) - lens),lens) + np.arange(lens.sum())
+    return data[idx]
+
+
+class AggregateWriter(object):
+    """
+    Copies songs from HDF5 files into an open aggregate / summary file.
+    Songs are kept in memory, batchsize at a time, then each table and
+    each array gets a single append per batch, and the file is flushed.
+    The indices (e.g. idx_segments_start) are computed from the length of
+    the arrays, with one vectorized addition per copied batch, or per
+    file for aggregate files added with append_file.
+    Songs can be added to a file that already contains some.
+    Only the columns and arrays that exist in the file are copied,
+    see fields in create_aggregate_file.
+    If the file has an artists table (see artist_table in create_aggregate_file)
+    the artist fields are written once per artist_id, from its first song.
+    If skip_existing=True, the track ids in the file are loaded once
+    and songs already there (or already added) are skipped.
+    If checkpoint=True, each flush also saves in the file attributes the
+    number of input files completely written (starting at nfilesdone) and
+    the length of the tables and arrays, see resume_aggregate_file.
+    USAGE
+       writer = AggregateWriter(h5)
+       for h5filename in h5_filenames:
+           writer.add_file(h5filename)
+       writer.flush() # do not forget!
+    """
+    def __init__(self,h5,summaryfile=False,batchsize=100,skip_existing=False,
+                 checkpoint=False,nfilesdone=0):
+        self.h5 = h5
+        self.summaryfile = summaryfile
+        self.batchsize = batchsize
+        # track ids to skip, None if we copy everything
+        self.track_ids = None
+        self.nskipped = 0
+        if skip_existing:
+            self.track_ids = set(h5.root.analysis.songs.read(field='track_id'))
+        self.tables = {}
+        for group in SONG_TABLES:
+            self.tables[group] = h5.getNode('/'+group,'songs')
+        # arrays in the file, none for summary files, some for projected files
+        self.arrays = {}
+        if not summaryfile:
+            for name,(group,idxcol) in ARRAY_INDICES.items():
+                if name in h5.getNode('/'+group)._v_children:
+                    self.arrays[name] = h5.getNode('/'+group,name)
+        # vocabularies of the arrays stored as codes, string -> code,
+        # and new strings waiting to be written
+        self.vocabs = {}
+        self.vocabbufs = {}
+        for name,array in self.arrays.items():
+            vocab = read_vocab(array)
+            if vocab is not None:
+                self.vocabs[name] = dict([(s,code) for code,s in enumerate(vocab)])
+                self.vocabbufs[name] = []
+        # artists table, if any, and the row of each artist_id
+        self.artisttable = None
+        self.artistrows = {}
+        self.artistbufs = []
+        if 'artists' in h5.root.metadata._v_children:
+            self.artisttable = h5.root.metadata.artists
+            for row,artist_id in enumerate(self.artisttable.read(field='artist_id')):
+                self.artistrows[artist_id] = row
+        # array that sets each index column, the one named like the index
+        # (e.g. artist_terms for idx_artist_terms) if it is in the file
+        self.idxarrays = {}
+        for name in sorted(self.arrays.keys()):
+            group,idxcol = ARRAY_INDICES[name]
+            if not idxcol in self.idxarrays or idxcol == 'idx_'+name:
+                self.idxarrays[idxcol] = name
+        # current length of the arrays, including what is buffered
+        self.arraylens = {}
+        for name,array in self.arrays.items():
+            self.arraylens[name] = array.shape[0]
+        # buffers
+        self.rowbufs = dict([(tablegroup,[]) for tablegroup in SONG_TABLES])
+        self.arraybufs = dict([(name,[]) for name in self.arrays])
+        self.nbuffered = 0
+        # number of songs, including what is buffered
+        self.nsongs = self.tables['analysis'].nrows
+        # input files completely added, and where they end (the
+        # checkpoint, a file copied in many batches can be half-written)
+        self.nfiles = nfilesdone
+        self.filesend = (self.nsongs,len(self.artistrows),dict(self.arraylens))
+        self.checkpoint = checkpoint
+        if checkpoint:
+            self.write_checkpoint()
+
+    def add_file(self,h5filename):
+        """
+        Add all songs (1 if regular file, more if aggregate file)
+        from the HDF5 file with that name
+        """
+        h5tocopy = open_h5_file_read(h5filename)
+        try:
+            # big aggregate files are copied batchsize songs at a time
+            nSongs = get_num_songs(h5tocopy)
+            for start in xrange(0,nSongs,self.batchsize):
+                self.add_songs(h5tocopy,start,start+self.batchsize)
+        finally:
+            h5tocopy.close()
+        self.nfiles += 1
+        self.filesend = (self.nsongs,len(self.artistrows),dict(self.arraylens))
+
+    def append_file(self,h5filename,chunksize=10000):
+        """
+        Append all songs of an aggregate file that has the same arrays
+        (e.g. a shard, see create_aggregate_file.py) without going through
+        add_songs: tables and arrays are copied chunksize songs / chunksize
+        * 100 array rows at a time, and each idx_* column is rebased once
+        for the whole file, by the length of its array before the file.
+        Falls back to add_file if songs must be skipped (skip_existing)
+        or artists / vocabularies are involved.
+        """
+        h5tocopy = open_h5_file_read(h5filename)
+        try:
+            srcarrays = {}
+            for name,(group,idxcol) in ARRAY_INDICES.items():
+                if name in h5tocopy.getNode('/'+group)._v_children:
+                    srcarrays[name] = h5tocopy.getNode('/'+group,name)
+            fallback = (self.track_ids is not None or self.artisttable is not None
+                        or len(self.vocabs) > 0 or sorted(srcarrays) != sorted(self.arrays)
+                        or 'artists' in h5tocopy.root.metadata._v_children
+                        or any([read_vocab(array) is not None for array in srcarrays.values()]))
+            if not fallback:
+                # what is buffered goes first, then arrays lengths are
+                # where this file starts
+                self.flush()
+                base = dict(self.arraylens)
+                nSongs = get_num_songs(h5tocopy)
+                for group,table in self.tables.items():
+                    srctable = h5tocopy.getNode('/'+group,'songs')
+                    for start in xrange(0,nSongs,chunksize):
+                        srcrows = srctable.read(start,start+chunksize)
+                        rows = np.zeros(srcrows.shape[0],dtype=table.dtype)
+                        for field in table.colnames:
+                            if field[:4] == 'idx_':
+                                if field in self.idxarrays:
+                                    rows[field] = srcrows[field] + base[self.idxarrays[field]]
+                            elif field in srcrows.dtype.names:
+                                rows[field] = srcrows[field]
+                        table.append(rows)
+                for name,array in self.arrays.items():
+                    srcarray = srcarrays[name]
+                    for start in xrange(0,srcarray.shape[0],chunksize*100):
+                        data = srcarray[start:start+chunksize*100]
+                        if srcarray.atom.dtype == np.uint8 and array.atom.dtype != np.uint8:
+                            data = decode_array(data,name=name)
+                        array.append(encode_array(array,data))
+                    self.arraylens[name] += srcarray.shape[0]
+                self.nsongs += nSongs
+                self.h5.flush()
+        finally:
+            h5tocopy.close()
+        if fallback:
+            self.add_file(h5filename)
+            return
+        self.nfiles += 1
+        self.filesend = (self.nsongs,len(self.artistrows),dict(self.arraylens))
+        if self.checkpoint:
+            self.write_checkpoint()
+
+    def add_songs(self,h5tocopy,start=0,stop=None):
+        """
+        Add songs from an open HDF5 file, all of them by default,
+        or the ones with index start to stop-1
+        """
+        if stop is None:
+            stop = get_num_songs(h5tocopy)
+        # TABLES, one read per table, indices are recomputed
+        # we also read the song after the last one, to know where its arrays stop
+        srcrows = {}
+        srcnext = {}
+        for group in self.tables.keys():
+            srcrows[group] = h5tocopy.getNode('/'+group,'songs').read(start,stop+1)
+            if srcrows[group].shape[0] > stop - start:
+                srcnext[group] = srcrows[group][-1]
+                srcrows[group] = srcrows[group][:-1]
+        nSongs = srcrows['analysis'].shape[0]
+        if nSongs == 0:
+            return
+        # source with an artists table, we read the artist of each song
+        srcartists = None
+        if 'artists' in h5tocopy.root.metadata._v_children:
+            srcartisttable = h5tocopy.root.metadata.artists
+            srcartistrows = srcrows['metadata']['artist_row'].astype('int64')
+            artistrows,inverse = np.unique(srcartistrows,return_inverse=True)
+            srcartists = srcartisttable.readCoordinates(artistrows)[inverse]
+        # songs we keep, all of them unless we skip known track ids
+        keep = np.ones(nSongs,dtype='bool')
+        if self.track_ids is not None:
+            for songidx,track_id in enumerate(srcrows['analysis']['track_id']):
+                if track_id in self.track_ids:
+                    keep[songidx] = False
+                else:
+                    self.track_ids.add(track_id)
+            self.nskipped += nSongs - int(keep.sum())
+            if not keep.any():
+                return
+        rows = {}
+        for group,table in self.tables.items():
+            rows[group] = np.zeros(keep.sum(),dtype=table.dtype)
+            for field in table.colnames:
+                if field[:4] == 'idx_' or field == 'artist_row':
+                    continue
+                if field in srcrows[group].dtype.names:
+                    rows[group][field] = srcrows[group][field][keep]
+                elif group == 'metadata' and srcartists is not None and field in srcartists.dtype.names:
+                    rows[group][field] = srcartists[field][keep]
+            self.rowbufs[group].append(rows[group])
+        # ARTISTS, songs point to their artist, new artists get a row
+        newartist = np.zeros(nSongs,dtype='bool')
+        if self.artisttable is not None:
+            artist_ids = srcrows['metadata']['artist_id']
+            artistrow = rows['metadata']['artist_row']
+            for k,songidx in enumerate(np.where(keep)[0]):
+                if not artist_ids[songidx] in self.artistrows:
+                    self.artistrows[artist_ids[songidx]] = len(self.artistrows)
+                    newartist[songidx] = True
+                artistrow[k] = self.artistrows[artist_ids[songidx]]
+            rows['artists'] = np.zeros(newartist.sum(),dtype=self.artisttable.dtype)
+            for field in self.artisttable.colnames:
+                if field[:4] == 'idx_':
+                    continue
+                if field in srcrows['metadata'].dtype.names:
+                    rows['artists'][field] = srcrows['metadata'][field][newartist]
+                elif srcartists is not None:
+                    rows['artists'][field] = srcartists[field][newartist]
+            self.artistbufs.append(rows['artists'])
+        # ARRAYS, one read per array
+        for name,array in self.arrays.items():
+            group,idxcol = ARRAY_INDICES[name]
+            srcarray = h5tocopy.getNode('/'+group,name)
+            # part of the source array for each song
+            if srcartists is not None and idxcol in srcartisttable.colnames:
+                srcidx = np.concatenate([srcartisttable.read(field=idxcol),[srcarray.shape[0]]]).astype('int64')
+                starts = srcidx[srcartistrows]
+                stops = srcidx[srcartistrows+1]
+            else:
+                starts = srcrows[group][idxcol].astype('int64')
+                if group in srcnext:
+                    srcend = int(srcnext[group][idxcol])
+                else:
+                    srcend = srcarray.shape[0]
+                stops = np.concatenate([starts[1:],[srcend]])
+            # parts we copy, per song, or per new artist for artist arrays
+            idxrows = rows[group]
+            if self.artisttable is not None and idxcol in self.artisttable.colnames:
+                idxrows = rows['artists']
+                sel = newartist
+            else:
+                sel = keep
+            data = read_array_parts(srcarray,starts[sel],stops[sel])
+            lens = stops[sel] - starts[sel]
+            # one array sets each index, e.g. artist_terms for idx_artist_terms
+            # (also used by artist_terms_freq)
+            if self.idxarrays[idxcol] == name:
+                idxrows[idxcol] = self.arraylens[name] + np.cumsum(lens) - lens
+            if srcarray.atom.dtype == np.uint8 and array.atom.dtype != np.uint8:
+                data = decode_array(data,name=name)
+            data = decode_strings(srcarray,data)
+            if name in self.vocabs:
+                data = self.encode_strings(name,data)
+            data = encode_array(array,data)
+            self.arraybufs[name].append(data)
+            self.arraylens[name] += data.shape[0]
+        self.nbuffered += rows['analysis'].shape[0]
+        self.nsongs += rows['analysis'].shape[0]
+        if self.nbuffered >= self.batchsize:
+            self.flush()
+
+    def encode_strings(self,name,data):
+        """
+        Codes of the given strings in the vocabulary of an array,
+        new strings are added to the vocabulary
+        """
+        vocab = self.vocabs[name]
+        strings,inverse = np.unique(data,return_inverse=True)
+        codes = np.zeros(strings.shape[0],dtype='int32')
+        for k,s in enumerate(strings):
+            if not s in vocab:
+                vocab[s] = len(vocab)
+                self.vocabbufs[name].append(s)
+            codes[k] = vocab[s]
+        return codes[inverse]
+
+    def flush(self):
+        """
+        Write all buffered songs to the aggregate file
+        """
+        # new strings first, so codes always point to something
+        for name,strings in self.vocabbufs.items():
+            if len(strings) > 0:
+                vocabnode = self.arrays[name]._v_parent._v_children[name+VOCAB_SUFFIX]
+                vocabnode.append(np.array(strings,dtype=vocabnode.atom.dtype))
+            self.vocabbufs[name] = []
+        if len(self.artistbufs) > 0:
+            self.artisttable.append(np.concatenate(self.artistbufs))
+        self.artistbufs = []
+        for group,table in self.tables.items():
+            if len(self.rowbufs[group]) > 0:
+                table.append(np.concatenate(self.rowbufs[group]))
+            self.rowbufs[group] = []
+        for name,array in self.arrays.items():
+            if len(self.arraybufs[name]) > 0:
+                data = np.concatenate(self.arraybufs[name])
+                if data.shape[0] > 0:
+                    array.append(data)
+            self.arraybufs[name] = []
+        self.nbuffered = 0
+        if self.checkpoint:
+            self.write_checkpoint()
+        self.h5.flush()
+
+    def write_checkpoint(self):
+        """
+        Save in the file attributes the number of input files completely
+        added, and the number of songs, of artists, and length of the arrays
+        when the last of them was added. Must be called when nothing is buffered,
+        songs from the next file might already be written.
+        """
+        attrs = self.h5.root._v_attrs
+        attrs.checkpoint_nfiles = self.nfiles
+        attrs.checkpoint_nsongs = self.filesend[0]
+        attrs.checkpoint_nartists = self.filesend[1]
+        attrs.checkpoint_arraylens = self.filesend[2]
+
+
+def fill_hdf5_aggregate_file(h5,h5_filenames,summaryfile=False,batchsize=100,
+                             skip_existing=False,checkpoint=False,nfilesdone=0):
     """
     Fill an open hdf5 aggregate file using all the content from all the HDF5 files
     listed as filenames. These HDF5 files are supposed to be filled already.
@@ -226,144 +604,101 @@ def fill_hdf5_aggregate_file(h5,h5_filenames,summaryfile=False):
     For the arrays (e.g. segment_start) we need the indecies (e.g. idx_segment_start)
     to know which part of the array belongs to one particular song.
     If summaryfile=True, we skip arrays (indices all 0)
+    If h5 was created with a subset of the fields (see create_aggregate_file),
+    only those are copied.
+    Songs are written batchsize at a time, see AggregateWriter.
+    If skip_existing=True, songs whose track id is already in h5 are skipped,
+    i.e. we only add new songs to an existing file.
+    If checkpoint=True, progress is saved in the file after each batch,
+    h5_filenames being the input files after the first nfilesdone ones,
+    see resume_aggregate_file.
+    RETURN
+       number of songs skipped
     """
-    # counter
-    counter = 0
-    # iterate over filenames
-    for h5idx,h5filename in enumerate(h5_filenames):
-        # open h5 file
-        h5tocopy = open_h5_file_read(h5filename)
-        # get number of songs in new file
-        nSongs = get_num_songs(h5tocopy)
-        # iterate over songs in one HDF5 (1 if regular file, more if aggregate file)
-        for songidx in xrange(nSongs):
-            # METADATA
-            row = h5.root.metadata.songs.row
-            row["artist_familiarity"] = get_artist_familiarity(h5tocopy,songidx)
-            row["artist_hotttnesss"] = get_artist_hotttnesss(h5tocopy,songidx)
-            row["artist_id"] = get_artist_id(h5tocopy,songidx)
-            row["artist_mbid"] = get_artist_mbid(h5tocopy,songidx)
-            row["artist_playmeid"] = get_artist_playmeid(h5tocopy,songidx)
-            row["artist_7digitalid"] = get_artist_7digitalid(h5tocopy,songidx)
-            row["artist_latitude"] = get_artist_latitude(h5tocopy,songidx)
-            row["artist_location"] = get_artist_location(h5tocopy,songidx)
-            row["artist_longitude"] = get_artist_longitude(h5tocopy,songidx)
-            row["artist_name"] = get_artist_name(h5tocopy,songidx)
-            row["release"] = get_release(h5tocopy,songidx)
-            row["release_7digitalid"] = get_release_7digitalid(h5tocopy,songidx)
-            row["song_id"] = get_song_id(h5tocopy,songidx)
-            row["song_hotttnesss"] = get_song_hotttnesss(h5tocopy,songidx)
-            row["title"] = get_title(h5tocopy,songidx)
-            row["track_7digitalid"] = get_track_7digitalid(h5tocopy,songidx)
-            # INDICES
-            if not summaryfile:
-                if counter == 0 : # we're first row
-                    row["idx_similar_artists"] = 0
-                    row["idx_artist_terms"] = 0
-                else:
-                    row["idx_similar_artists"] = h5.root.metadata.similar_artists.shape[0]
-                    row["idx_artist_terms"] = h5.root.metadata.artist_terms.shape[0]
-            row.append()
-            h5.root.metadata.songs.flush()
-            # ARRAYS
-            if not summaryfile:
-                h5.root.metadata.similar_artists.append( get_similar_artists(h5tocopy,songidx) )
-                h5.root.metadata.artist_terms.append( get_artist_terms(h5tocopy,songidx) )
-                h5.root.metadata.artist_terms_freq.append( get_artist_terms_freq(h5tocopy,songidx) )
-                h5.root.metadata.artist_terms_weight.append( get_artist_terms_weight(h5tocopy,songidx) )
-            # ANALYSIS
-            row = h5.root.analysis.songs.row
-            row["analysis_sample_rate"] = get_analysis_sample_rate(h5tocopy,songidx)
-            row["audio_md5"] = get_audio_md5(h5tocopy,songidx)
-            row["danceability"] = get_danceability(h5tocopy,songidx)
-            row["duration"] = get_duration(h5tocopy,songidx)
-            row["end_of_fade_in"] = get_end_of_fade_in(h5tocopy,songidx)
-            row["energy"] = get_energy(h5tocopy,songidx)
-            row["key"] = get_key(h5tocopy,songidx)
-            row["key_confidence"] = get_key_confidence(h5tocopy,songidx)
-            row["loudness"] = get_loudness(h5tocopy,songidx)
-            row["mode"] = get_mode(h5tocopy,songidx)
-            row["mode_confidence"] = get_mode_confidence(h5tocopy,songidx)
-            row["start_of_fade_out"] = get_start_of_fade_out(h5tocopy,songidx)
-            row["tempo"] = get_tempo(h5tocopy,songidx)
-            row["time_signature"] = get_time_signature(h5tocopy,songidx)
-            row["time_signature_confidence"] = get_time_signature_confidence(h5tocopy,songidx)
-            row["track_id"] = get_track_id(h5tocopy,songidx)
-            # INDICES
-            if not summaryfile:
-                if counter == 0 : # we're first row
-                    row["idx_segments_start"] = 0
-                    row["idx_segments_confidence"] = 0
-                    row["idx_segments_pitches"] = 0
-                    row["idx_segments_timbre"] = 0
-                    row["idx_segments_loudness_max"] = 0
-                    row["idx_segments_loudness_max_time"] = 0
-                    row["idx_segments_loudness_start"] = 0
-                    row["idx_sections_start"] = 0
-                    row["idx_sections_confidence"] = 0
-                    row["idx_beats_start"] = 0
-                    row["idx_beats_confidence"] = 0
-                    row["idx_bars_start"] = 0
-                    row["idx_bars_confidence"] = 0
-                    row["idx_tatums_start"] = 0
-                    row["idx_tatums_confidence"] = 0
-                else : # check the current shape of the arrays
-                    row["idx_segments_start"] = h5.root.analysis.segments_start.shape[0]
-                    row["idx_segments_confidence"] = h5.root.analysis.segments_confidence.shape[0]
-                    row["idx_segments_pitches"] = h5.root.analysis.segments_pitches.shape[0]
-                    row["idx_segments_timbre"] = h5.root.analysis.segments_timbre.shape[0]
-                    row["idx_segments_loudness_max"] = h5.root.analysis.segments_loudness_max.shape[0]
-                    row["idx_segments_loudness_max_time"] = h5.root.analysis.segments_loudness_max_time.shape[0]
-                    row["idx_segments_loudness_start"] = h5.root.analysis.segments_loudness_start.shape[0]
-                    row["idx_sections_start"] = h5.root.analysis.sections_start.shape[0]
-                    row["idx_sections_confidence"] = h5.root.analysis.sections_confidence.shape[0]
-                    row["idx_beats_start"] = h5.root.analysis.beats_start.shape[0]
-                    row["idx_beats_confidence"] = h5.root.analysis.beats_confidence.shape[0]
-                    row["idx_bars_start"] = h5.root.analysis.bars_start.shape[0]
-                    row["idx_bars_confidence"] = h5.root.analysis.bars_confidence.shape[0]
-                    row["idx_tatums_start"] = h5.root.analysis.tatums_start.shape[0]
-                    row["idx_tatums_confidence"] = h5.root.analysis.tatums_confidence.shape[0]
-            row.append()
-            h5.root.analysis.songs.flush()
-            # ARRAYS
-            if not summaryfile:
-                h5.root.analysis.segments_start.append( get_segments_start(h5tocopy,songidx) )
-                h5.root.analysis.segments_confidence.append( get_segments_confidence(h5tocopy,songidx) )
-                h5.root.analysis.segments_pitches.append( get_segments_pitches(h5tocopy,songidx) )
-                h5.root.analysis.segments_timbre.append( get_segments_timbre(h5tocopy,songidx) )
-                h5.root.analysis.segments_loudness_max.append( get_segments_loudness_max(h5tocopy,songidx) )
-                h5.root.analysis.segments_loudness_max_time.append( get_segments_loudness_max_time(h5tocopy,songidx) )
-                h5.root.analysis.segments_loudness_start.append( get_segments_loudness_start(h5tocopy,songidx) )
-                h5.root.analysis.sections_start.append( get_sections_start(h5tocopy,songidx) )
-                h5.root.analysis.sections_confidence.append( get_sections_confidence(h5tocopy,songidx) )
-                h5.root.analysis.beats_start.append( get_beats_start(h5tocopy,songidx) )
-                h5.root.analysis.beats_confidence.append( get_beats_confidence(h5tocopy,songidx) )
-                h5.root.analysis.bars_start.append( get_bars_start(h5tocopy,songidx) )
-                h5.root.analysis.bars_confidence.append( get_bars_confidence(h5tocopy,songidx) )
-                h5.root.analysis.tatums_start.append( get_tatums_start(h5tocopy,songidx) )
-                h5.root.analysis.tatums_confidence.append( get_tatums_confidence(h5tocopy,songidx) )
-            # MUSICBRAINZ
-            row = h5.root.musicbrainz.songs.row
-            row["year"] = get_year(h5tocopy,songidx)
-            # INDICES
-            if not summaryfile:
-                if counter == 0 : # we're first row
-                    row["idx_artist_mbtags"] = 0
-                else:
-                    row["idx_artist_mbtags"] = h5.root.musicbrainz.artist_mbtags.shape[0]
-            row.append()
-            h5.root.musicbrainz.songs.flush()
-            # ARRAYS
-            if not summaryfile:
-                h5.root.musicbrainz.artist_mbtags.append( get_artist_mbtags(h5tocopy,songidx) )
-                h5.root.musicbrainz.artist_mbtags_count.append( get_artist_mbtags_count(h5tocopy,songidx) )
-            # counter
-            counter += 1
-        # close h5 file
-        h5tocopy.close()
+    writer = AggregateWriter(h5,summaryfile=summaryfile,batchsize=batchsize,
+                             skip_existing=skip_existing,checkpoint=checkpoint,
+                             nfilesdone=nfilesdone)
+    for h5filename in h5_filenames:
+        writer.add_file(h5filename)
+    writer.flush()
+    return writer.nskipped
 
 
-def create_song_file(h5filename,title='H5 Song File',force=False,complevel=1):
+def resume_aggregate_file(h5):
+    """
+    Get an aggregate / summary file filled with checkpoint=True (see
+    AggregateWriter) back to its last checkpoint: songs and array data
+    written after it (a batch interrupted halfway) are removed.
+    INPUT
+       h5   - aggregate file, open in append mode
+    RETURN
+       number of input files completely written, we restart after them
+    Raise a ValueError if the file has no checkpoint.
+    """
+    attrs = h5.root._v_attrs
+    if not 'checkpoint_nfiles' in attrs._v_attrnames:
+        raise ValueError('no checkpoint in file, can not resume')
+    for group in SONG_TABLES:
+        table = h5.getNode('/'+group,'songs')
+        if table.nrows > attrs.checkpoint_nsongs:
+            table.truncate(attrs.checkpoint_nsongs)
+    if 'artists' in h5.root.metadata._v_children:
+        if h5.root.metadata.artists.nrows > attrs.checkpoint_nartists:
+            h5.root.metadata.artists.truncate(attrs.checkpoint_nartists)
+    for name,arraylen in attrs.checkpoint_arraylens.items():
+        group,idxcol = ARRAY_INDICES[name]
+        array = h5.getNode('/'+group,name)
+        if array.shape[0] > arraylen:
+            array.truncate(arraylen)
+    h5.flush()
+    return attrs.checkpoint_nfiles
+
+
+def count_file_rows(h5filename):
+    """
+    Number of songs and of rows in each array of an HDF5 file (song file
+    or aggregate file). Only the shapes are read, not the data.
+    Summing this over many files gives the exact size of an aggregate
+    file, see arrayrows in create_aggregate_file.
+    RETURN
+       dictionary, 'songs' -> number of songs, array name -> number of rows
+    """
+    h5 = open_h5_file_read(h5filename)
+    try:
+        counts = {'songs':get_num_songs(h5)}
+        for name,(group,idxcol) in ARRAY_INDICES.items():
+            groupnode = h5.getNode('/'+group)
+            if name in groupnode._v_children:
+                counts[name] = groupnode._v_children[name].shape[0]
+    finally:
+        h5.close()
+    return counts
+
+
+def create_track_id_index(h5):
+    """
+    Create (or recreate) the track id index of an aggregate / summary file,
+    a table /analysis/track_id_index with columns track_id and songidx,
+    sorted by track_id. Used by find_songidx (hdf5_getters) to find a song
+    by binary search instead of scanning the track_id column.
+    Must be called again if songs are added to the file.
+    INPUT
+       h5   - aggregate file, open in append mode, already filled
+    """
+    group = h5.root.analysis
+    if 'track_id_index' in group._v_children:
+        h5.removeNode(group,'track_id_index')
+    track_ids = group.songs.read(field='track_id')
+    order = np.argsort(track_ids,kind='mergesort')
+    index = np.zeros(track_ids.shape[0],dtype=[('track_id',track_ids.dtype),('songidx','int64')])
+    index['track_id'] = track_ids[order]
+    index['songidx'] = order
+    h5.createTable(group,'track_id_index',index,'track ids sorted, and their song index')
+    h5.flush()
+
+
+def create_song_file(h5filename,title='H5 Song File',force=False,complevel=1,
+                     precision='float64',pitches_precision=None):
     """
     Create a new HDF5 file for a new song.
     If force=False, refuse to overwrite an existing file
@@ -375,6 +710,8 @@ def create_song_file(h5filename,title='H5 Song File',force=False,complevel=1):
     DETAIL
     - we set the compression level to 1 by default, it uses the ZLIB library
       to disable compression, set it to 0
+    - analysis arrays are float64 by default, see create_all_arrays for
+      precision and pitches_precision
     """
     # check if file exists
     if not force:
@@ -404,13 +741,16 @@ def create_song_file(h5filename,title='H5 Song File',force=False,complevel=1):
     r.append() # filled with default values 0 or '' (depending on type)
     table.flush()
     # create arrays
-    create_all_arrays(h5,expectedrows=3)
+    create_all_arrays(h5,expectedrows=3,precision=precision,
+                      pitches_precision=pitches_precision)
     # close it, done
     h5.close()
 
 
 def create_aggregate_file(h5filename,title='H5 Aggregate File',force=False,expectedrows=1000,complevel=1,
-                          summaryfile=False):
+                          summaryfile=False,precision='float64',pitches_precision=None,
+                          profile=None,segments_per_song=300,fields=None,arrayrows=None,
+                          encode_strings=False,artist_table=False):
     """
     Create a new HDF5 file for all songs.
     It will contains everything that are in regular song files.
@@ -425,6 +765,24 @@ def create_aggregate_file(h5filename,title='H5 Aggregate File',force=False,expec
       setting the chunking correctly).
     - we set the compression level to 1 by default, it uses the ZLIB library
       to disable compression, set it to 0
+    - analysis arrays are float64 by default, see create_all_arrays for
+      precision and pitches_precision
+    - profile is the name of one of the STORAGE_PROFILES, e.g. 'fastread'
+      (blosc, one song per chunk) or 'archive' (zlib 9), it replaces complevel.
+      segments_per_song is the average number of segments per song, used
+      with expectedrows to size the arrays and their chunks.
+      arrayrows gives the exact number of rows of some arrays instead (see
+      count_file_rows), then expectedrows should be the exact number of songs.
+    - if encode_strings, similar_artists and artist_terms are stored as
+      codes in vocabularies, see create_all_arrays.
+    - fields is a list of fields (columns and arrays, named like the
+      getters without 'get_'), e.g. ['artist_id','segments_timbre'], only
+      those are created. track_id and the idx_* columns are always kept,
+      and artist_id with artist_table.
+      Default is all of them.
+    - if artist_table, fields that are the same for all songs of an artist
+      (ARTIST_COLUMNS and ARTIST_ARRAYS in hdf5_getters) are stored once per
+      artist in a table /metadata/artists, see split_artist_description.
 
     Setups the groups, each containing a table 'songs' with one row:
     - metadata
@@ -434,87 +792,238 @@ def create_aggregate_file(h5filename,title='H5 Aggregate File',force=False,expec
     if not force:
         if os.path.exists(h5filename):
             raise ValueError('file exists, can not create HDF5 song file')
+    # check the projection
+    if fields is not None:
+        known = ARRAY_INDICES.keys()
+        for desc in (DESC.SongMetaData,DESC.SongAnalysis,DESC.SongMusicBrainz):
+            known.extend(desc.columns.keys())
+        for field in fields:
+            if not field in known:
+                raise ValueError('unknown field: '+str(field))
+    # check the precisions before creating anything
+    if not summaryfile:
+        check_precisions(precision,pitches_precision)
     # summary file? change title
     if summaryfile:
         title = 'H5 Summary File'
     # create the H5 file
     h5 = tables.openFile(h5filename, mode='w', title='H5 Song File')
     # set filter level
-    h5.filters = tables.Filters(complevel=complevel,complib='zlib')
+    chunksongs = None
+    if profile is None:
+        h5.filters = tables.Filters(complevel=complevel,complib='zlib')
+    else:
+        prof = STORAGE_PROFILES[profile]
+        h5.filters = tables.Filters(complevel=prof['complevel'],complib=prof['complib'],
+                                    shuffle=prof['shuffle'])
+        chunksongs = prof['chunksongs']
     # setup the groups and tables
         # group metadata
     group = h5.createGroup("/",'metadata','metadata about the song')
-    table = h5.createTable(group,'songs',DESC.SongMetaData,'table of metadata for one song',
-                           expectedrows=expectedrows)
+    metadesc = project_description(DESC.SongMetaData,fields,artist_table=artist_table)
+    if artist_table:
+        metadesc,artistdesc = split_artist_description(metadesc)
+        table = h5.createTable(group,'artists',artistdesc,
+                               'table of metadata for one artist',expectedrows=expectedrows)
+    table = h5.createTable(group,'songs',metadesc,
+                           'table of metadata for one song',expectedrows=expectedrows)
         # group analysis
     group = h5.createGroup("/",'analysis','Echo Nest analysis of the song')
-    table = h5.createTable(group,'songs',DESC.SongAnalysis,'table of Echo Nest analysis for one song',
-                           expectedrows=expectedrows)
+    table = h5.createTable(group,'songs',project_description(DESC.SongAnalysis,fields),
+                           'table of Echo Nest analysis for one song',expectedrows=expectedrows)
         # group musicbrainz
     group = h5.createGroup("/",'musicbrainz','data about the song coming from MusicBrainz')
-    table = h5.createTable(group,'songs',DESC.SongMusicBrainz,'table of data coming from MusicBrainz',
-                           expectedrows=expectedrows)
+    table = h5.createTable(group,'songs',project_description(DESC.SongMusicBrainz,fields),
+                           'table of data coming from MusicBrainz',expectedrows=expectedrows)
     # create arrays
     if not summaryfile:
-        create_all_arrays(h5,expectedrows=expectedrows)
+        create_all_arrays(h5,expectedrows=expectedrows,precision=precision,
+                          pitches_precision=pitches_precision,chunksongs=chunksongs,
+                          segments_per_song=segments_per_song,arrayrows=arrayrows,
+                          encode_strings=encode_strings)
+        # projection, remove the arrays we do not want (they are empty)
+        if fields is not None:
+            for name,(group,idxcol) in ARRAY_INDICES.items():
+                if not name in fields:
+                    h5.removeNode('/'+group,name)
+                    if name+VOCAB_SUFFIX in h5.getNode('/'+group)._v_children:
+                        h5.removeNode('/'+group,name+VOCAB_SUFFIX)
     # close it, done
     h5.close()
 
 
-def create_all_arrays(h5,expectedrows=1000):
+def project_description(desc,fields=None,artist_table=False):
+    """
+    Description of a songs table (e.g. DESC.SongAnalysis) with only
+    the given fields, plus track_id and the idx_* columns, and artist_id
+    if artist_table (the artists table is keyed by artist_id).
+    Returns desc itself if fields is None.
+    """
+    if fields is None:
+        return desc
+    columns = {}
+    for name,col in desc.columns.items():
+        if name in fields or name[:4] == 'idx_' or name == 'track_id':
+            columns[name] = col
+        elif artist_table and name == 'artist_id':
+            columns[name] = col
+    return columns
+
+
+def split_artist_description(desc):
+    """
+    Split the description of the metadata songs table (class or dictionary
+    of columns, see project_description) in two:
+    - songs: the artist columns are replaced by artist_row, the index
+      of the artist in the artists table
+    - artists: artist_id, the artist columns (ARTIST_COLUMNS) and the index
+      columns of the artist arrays (ARTIST_ARRAYS, e.g. idx_artist_terms)
+    RETURN
+       songs columns, artists columns (dictionaries)
+    """
+    if not isinstance(desc,dict):
+        desc = desc.columns
+    artistidx = [ARRAY_INDICES[name][1] for name in ARTIST_ARRAYS]
+    songcols = {'artist_row':tables.IntCol()}
+    artistcols = {}
+    for name,col in desc.items():
+        if name in ARTIST_COLUMNS or name in artistidx:
+            artistcols[name] = col
+        else:
+            songcols[name] = col
+        if name == 'artist_id':
+            artistcols[name] = col
+    return songcols,artistcols
+
+
+def check_precisions(precision,pitches_precision=None):
+    """
+    Raise a ValueError if precision is not in ARRAY_PRECISIONS or
+    pitches_precision not in PITCHES_PRECISIONS.
+    RETURN
+       pitches_precision (precision if it is None)
+    """
+    if not precision in ARRAY_PRECISIONS:
+        raise ValueError('precision must be one of '+', '.join(ARRAY_PRECISIONS)
+                         +', not '+str(precision))
+    if pitches_precision is None:
+        pitches_precision = precision
+    if not pitches_precision in PITCHES_PRECISIONS:
+        raise ValueError('pitches_precision must be one of '+', '.join(PITCHES_PRECISIONS)
+                         +', not '+str(pitches_precision))
+    return pitches_precision
+
+
+def create_all_arrays(h5,expectedrows=1000,precision='float64',pitches_precision=None,
+                      chunksongs=None,segments_per_song=300,arrayrows=None,
+                      encode_strings=False):
     """
     Utility functions used by both create_song_file and create_aggregate_files,
     creates all the EArrays (empty).
     INPUT
-       h5   - hdf5 file, open with write or append permissions
-              metadata and analysis groups already exist!
+       h5                 - hdf5 file, open with write or append permissions
+                            metadata and analysis groups already exist!
+       precision          - type of the analysis arrays (segments, beats, ...),
+                            'float64' by default, 'float32' halves the size,
+                            see ARRAY_PRECISIONS
+       pitches_precision  - type of segments_pitches, same as precision by
+                            default, can also be 'uint8' (pitches are in [0,1],
+                            quantized on 256 values), see PITCHES_PRECISIONS
+    Raise a ValueError for another precision.
+       chunksongs         - number of songs per chunk in the arrays, None lets
+                            pytables decide from expectedrows (see STORAGE_PROFILES)
+       segments_per_song  - average number of segments (and beats, tatums, ...)
+                            per song, used to size the analysis arrays
+       arrayrows          - dictionary array name -> exact number of rows,
+                            e.g. from count_file_rows, replaces the estimates
+                            for those arrays
+       encode_strings     - if True, similar_artists and artist_terms are int32
+                            codes in a vocabulary of unique strings (nodes
+                            similar_artists_vocab and artist_terms_vocab),
+                            much smaller since artists share terms, the
+                            getters decode them
     """
+    # atoms for analysis arrays
+    pitches_precision = check_precisions(precision,pitches_precision)
+    fatom = tables.Atom.from_dtype(np.dtype(precision))
+    patom = tables.Atom.from_dtype(np.dtype(pitches_precision))
+    # expected rows of each array, and rows per song for the chunks
+    nrows = {}
+    persong = {}
+    for name in ARRAY_INDICES.keys():
+        persong[name] = ROWS_PER_SONG.get(name,segments_per_song)
+        if arrayrows is not None and name in arrayrows:
+            persong[name] = arrayrows[name] * 1. / max(1,expectedrows)
+        nrows[name] = max(1,int(expectedrows*persong[name]))
     # group metadata arrays
     group = h5.root.metadata
-    h5.createEArray(where=group,name='similar_artists',atom=tables.StringAtom(20,shape=()),shape=(0,),title=ARRAY_DESC_SIMILAR_ARTISTS)
-    h5.createEArray(group,'artist_terms',tables.StringAtom(256,shape=()),(0,),ARRAY_DESC_ARTIST_TERMS,
-                    expectedrows=expectedrows*40)
+    if encode_strings:
+        h5.createEArray(where=group,name='similar_artists',atom=tables.Int32Atom(shape=()),shape=(0,),title=ARRAY_DESC_SIMILAR_ARTISTS,
+                        expectedrows=nrows['similar_artists'],chunkshape=array_chunkshape(chunksongs,persong['similar_artists']))
+        h5.createEArray(group,'similar_artists'+VOCAB_SUFFIX,tables.StringAtom(20,shape=()),(0,),ARRAY_DESC_SIMILAR_ARTISTS_VOCAB)
+        h5.createEArray(group,'artist_terms',tables.Int32Atom(shape=()),(0,),ARRAY_DESC_ARTIST_TERMS,
+                        expectedrows=nrows['artist_terms'],chunkshape=array_chunkshape(chunksongs,persong['artist_terms']))
+        h5.createEArray(group,'artist_terms'+VOCAB_SUFFIX,tables.StringAtom(256,shape=()),(0,),ARRAY_DESC_ARTIST_TERMS_VOCAB)
+    else:
+        h5.createEArray(where=group,name='similar_artists',atom=tables.StringAtom(20,shape=()),shape=(0,),title=ARRAY_DESC_SIMILAR_ARTISTS,
+                        expectedrows=nrows['similar_artists'],chunkshape=array_chunkshape(chunksongs,persong['similar_artists']))
+        h5.createEArray(group,'artist_terms',tables.StringAtom(256,shape=()),(0,),ARRAY_DESC_ARTIST_TERMS,
+                        expectedrows=nrows['artist_terms'],chunkshape=array_chunkshape(chunksongs,persong['artist_terms']))
     h5.createEArray(group,'artist_terms_freq',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_ARTIST_TERMS_FREQ,
-                    expectedrows=expectedrows*40)
+                    expectedrows=nrows['artist_terms_freq'],chunkshape=array_chunkshape(chunksongs,persong['artist_terms_freq']))
     h5.createEArray(group,'artist_terms_weight',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_ARTIST_TERMS_WEIGHT,
-                    expectedrows=expectedrows*40)
+                    expectedrows=nrows['artist_terms_weight'],chunkshape=array_chunkshape(chunksongs,persong['artist_terms_weight']))
     # group analysis arrays
     group = h5.root.analysis
-    h5.createEArray(where=group,name='segments_start',atom=tables.Float64Atom(shape=()),shape=(0,),title=ARRAY_DESC_SEGMENTS_START)
-    h5.createEArray(group,'segments_confidence',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_SEGMENTS_CONFIDENCE,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'segments_pitches',tables.Float64Atom(shape=()),(0,12),ARRAY_DESC_SEGMENTS_PITCHES,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'segments_timbre',tables.Float64Atom(shape=()),(0,12),ARRAY_DESC_SEGMENTS_TIMBRE,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'segments_loudness_max',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_SEGMENTS_LOUDNESS_MAX,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'segments_loudness_max_time',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_SEGMENTS_LOUDNESS_MAX_TIME,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'segments_loudness_start',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_SEGMENTS_LOUDNESS_START,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'sections_start',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_SECTIONS_START,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'sections_confidence',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_SECTIONS_CONFIDENCE,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'beats_start',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_BEATS_START,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'beats_confidence',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_BEATS_CONFIDENCE,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'bars_start',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_BARS_START,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'bars_confidence',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_BARS_CONFIDENCE,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'tatums_start',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_TATUMS_START,
-                    expectedrows=expectedrows*300)
-    h5.createEArray(group,'tatums_confidence',tables.Float64Atom(shape=()),(0,),ARRAY_DESC_TATUMS_CONFIDENCE,
-                    expectedrows=expectedrows*300)
+    h5.createEArray(where=group,name='segments_start',atom=fatom,shape=(0,),title=ARRAY_DESC_SEGMENTS_START,
+                    expectedrows=nrows['segments_start'],chunkshape=array_chunkshape(chunksongs,persong['segments_start']))
+    h5.createEArray(group,'segments_confidence',fatom,(0,),ARRAY_DESC_SEGMENTS_CONFIDENCE,
+                    expectedrows=nrows['segments_confidence'],chunkshape=array_chunkshape(chunksongs,persong['segments_confidence']))
+    h5.createEArray(group,'segments_pitches',patom,(0,12),ARRAY_DESC_SEGMENTS_PITCHES,
+                    expectedrows=nrows['segments_pitches'],chunkshape=array_chunkshape(chunksongs,persong['segments_pitches'],12))
+    h5.createEArray(group,'segments_timbre',fatom,(0,12),ARRAY_DESC_SEGMENTS_TIMBRE,
+                    expectedrows=nrows['segments_timbre'],chunkshape=array_chunkshape(chunksongs,persong['segments_timbre'],12))
+    h5.createEArray(group,'segments_loudness_max',fatom,(0,),ARRAY_DESC_SEGMENTS_LOUDNESS_MAX,
+                    expectedrows=nrows['segments_loudness_max'],chunkshape=array_chunkshape(chunksongs,persong['segments_loudness_max']))
+    h5.createEArray(group,'segments_loudness_max_time',fatom,(0,),ARRAY_DESC_SEGMENTS_LOUDNESS_MAX_TIME,
+                    expectedrows=nrows['segments_loudness_max_time'],chunkshape=array_chunkshape(chunksongs,persong['segments_loudness_max_time']))
+    h5.createEArray(group,'segments_loudness_start',fatom,(0,),ARRAY_DESC_SEGMENTS_LOUDNESS_START,
+                    expectedrows=nrows['segments_loudness_start'],chunkshape=array_chunkshape(chunksongs,persong['segments_loudness_start']))
+    h5.createEArray(group,'sections_start',fatom,(0,),ARRAY_DESC_SECTIONS_START,
+                    expectedrows=nrows['sections_start'],chunkshape=array_chunkshape(chunksongs,persong['sections_start']))
+    h5.createEArray(group,'sections_confidence',fatom,(0,),ARRAY_DESC_SECTIONS_CONFIDENCE,
+                    expectedrows=nrows['sections_confidence'],chunkshape=array_chunkshape(chunksongs,persong['sections_confidence']))
+    h5.createEArray(group,'beats_start',fatom,(0,),ARRAY_DESC_BEATS_START,
+                    expectedrows=nrows['beats_start'],chunkshape=array_chunkshape(chunksongs,persong['beats_start']))
+    h5.createEArray(group,'beats_confidence',fatom,(0,),ARRAY_DESC_BEATS_CONFIDENCE,
+                    expectedrows=nrows['beats_confidence'],chunkshape=array_chunkshape(chunksongs,persong['beats_confidence']))
+    h5.createEArray(group,'bars_start',fatom,(0,),ARRAY_DESC_BARS_START,
+                    expectedrows=nrows['bars_start'],chunkshape=array_chunkshape(chunksongs,persong['bars_start']))
+    h5.createEArray(group,'bars_confidence',fatom,(0,),ARRAY_DESC_BARS_CONFIDENCE,
+                    expectedrows=nrows['bars_confidence'],chunkshape=array_chunkshape(chunksongs,persong['bars_confidence']))
+    h5.createEArray(group,'tatums_start',fatom,(0,),ARRAY_DESC_TATUMS_START,
+                    expectedrows=nrows['tatums_start'],chunkshape=array_chunkshape(chunksongs,persong['tatums_start']))
+    h5.createEArray(group,'tatums_confidence',fatom,(0,),ARRAY_DESC_TATUMS_CONFIDENCE,
+                    expectedrows=nrows['tatums_confidence'],chunkshape=array_chunkshape(chunksongs,persong['tatums_confidence']))
     # group musicbrainz arrays
     group = h5.root.musicbrainz
     h5.createEArray(where=group,name='artist_mbtags',atom=tables.StringAtom(256,shape=()),shape=(0,),title=ARRAY_DESC_ARTIST_MBTAGS,
-                    expectedrows=expectedrows*5)
+                    expectedrows=nrows['artist_mbtags'],chunkshape=array_chunkshape(chunksongs,persong['artist_mbtags']))
     h5.createEArray(group,'artist_mbtags_count',tables.IntAtom(shape=()),(0,),ARRAY_DESC_ARTIST_MBTAGS_COUNT,
-                    expectedrows=expectedrows*5)
+                    expectedrows=nrows['artist_mbtags_count'],chunkshape=array_chunkshape(chunksongs,persong['artist_mbtags_count']))
+
+
+def array_chunkshape(chunksongs,rowspersong,ncols=None):
+    """
+    Chunk shape of an array so one chunk holds about chunksongs songs,
+    None if chunksongs is None (pytables decides)
+    """
+    if chunksongs is None:
+        return None
+    nrows = max(1,int(chunksongs*rowspersong))
+    if ncols is None:
+        return (nrows,)
+    return (nrows,ncols)
 
 
 def open_h5_file_read(h5filename):
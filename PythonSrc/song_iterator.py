@@ -0,0 +1,200 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+This code contains an iterator over all the songs of the dataset
+(or of any directory of song files). Files are read by a pool of
+processes, songs come back one by one, in order or not.
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import datetime
+import multiprocessing
+import hdf5_getters as GETTERS
+import utils
+
+
+# error passing problems
+class KeyboardInterruptError(Exception):pass
+
+
+def read_file_songs(h5filename,fields=None):
+    """
+    Read the given fields (all of them if None) of every song in
+    one HDF5 file.
+    RETURN
+       list of (h5filename, songidx, dictionary field -> value)
+    """
+    songs = []
+    h5 = GETTERS.open_h5_file_read(h5filename)
+    try:
+        nSongs = GETTERS.get_num_songs(h5)
+        if fields is None:
+            for songidx in xrange(nSongs):
+                songs.append( (h5filename,songidx,GETTERS.read_song(h5,songidx)) )
+            return songs
+        # table fields in one read per field, arrays through the index
+        arrayfields = filter(lambda f: f in GETTERS.ARRAY_INDICES,fields)
+        tablefields = filter(lambda f: not f in GETTERS.ARRAY_INDICES,fields)
+        if len(tablefields) > 0:
+            rows = GETTERS.read_fields(h5,tablefields)
+        if len(arrayfields) > 0:
+            arrayindex = GETTERS.ArrayIndex(h5)
+        for songidx in xrange(nSongs):
+            song = {}
+            for field in tablefields:
+                song[field] = rows[field][songidx]
+            for field in arrayfields:
+                song[field] = arrayindex.get_array(field,songidx)
+            songs.append( (h5filename,songidx,song) )
+    finally:
+        h5.close()
+    return songs
+
+
+def read_files_songs_wrapper(args):
+    """ wrapper for multiprocessing, read a chunk of files """
+    try:
+        h5filenames,fields = args
+        songs = []
+        for h5filename in h5filenames:
+            songs.extend( read_file_songs(h5filename,fields) )
+        return songs
+    except KeyboardInterrupt:
+        raise KeyboardInterruptError()
+
+
+def iter_songs(maindir,fields=None,workers=1,chunksize=10,ordered=True,maxpending=None):
+    """
+    Iterate over all songs of all HDF5 files in a directory (and its
+    subdirectories), e.g. the whole Million Song Dataset.
+    Files are read by 'workers' processes, 'chunksize' files at a time.
+    At most 'maxpending' chunks (2 per worker by default) are read in
+    advance, so we do not fill the memory if the caller is slow.
+    INPUT
+       maindir     - directory of song files, or list of song files
+       fields      - list of fields to read, e.g. ['artist_id','tempo'],
+                     all fields if None (slow!)
+       workers     - number of processes, 1 means no multiprocessing
+       chunksize   - number of files sent to a process at once
+       ordered     - if False, songs come as soon as they are read
+       maxpending  - max number of chunks being read or waiting
+    RETURN
+       iterator of (h5filename, songidx, dictionary field -> value)
+    """
+    if type(maindir).__name__ == 'str':
+        h5filenames = sorted(utils.get_all_files(maindir,ext='.h5'))
+    else:
+        h5filenames = list(maindir)
+    # no multiprocessing
+    if workers <= 1:
+        for h5filename in h5filenames:
+            for song in read_file_songs(h5filename,fields):
+                yield song
+        return
+    if maxpending is None:
+        maxpending = 2 * workers
+    chunks = [(h5filenames[k:k+chunksize],fields)
+              for k in xrange(0,len(h5filenames),chunksize)]
+    chunks.reverse() # we pop from the end
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        pending = []
+        while len(chunks) > 0 or len(pending) > 0:
+            # keep the pool busy, but not too busy
+            while len(chunks) > 0 and len(pending) < maxpending:
+                pending.append( pool.apply_async(read_files_songs_wrapper,(chunks.pop(),)) )
+            # next chunk of songs
+            if ordered:
+                res = pending.pop(0)
+            else:
+                ready = filter(lambda r: r.ready(),pending)
+                if len(ready) == 0:
+                    pending[0].wait(.05)
+                    continue
+                res = ready[0]
+                pending.remove(res)
+            for song in res.get():
+                yield song
+        pool.close()
+        pool.join()
+    finally:
+        # stopped early, or got an exception
+        pool.terminate()
+
+
+def die_with_usage():
+    """ HELP MENU """
+    print 'song_iterator.py'
+    print '   by T. Bertin-Mahieux (2011) Columbia University'
+    print '   tb2332@columbia.edu'
+    print ''
+    print 'Meant to be used as a library, see iter_songs.'
+    print 'From the command line, reads the given fields of every song'
+    print 'and reports how long it took.'
+    print ''
+    print 'usage:'
+    print '   python song_iterator.py [FLAGS] <H5 DIR> <field1> <field2> ...'
+    print 'PARAMS'
+    print '   H5 DIR     - directory contains h5 files (subdirs are checked)'
+    print '   field      - e.g. artist_id tempo, all fields if none given'
+    print 'FLAGS'
+    print '   -workers N - number of processes, default 1'
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+
+    # help menu
+    if len(sys.argv) < 2:
+        die_with_usage()
+
+    # flags
+    workers = 1
+    while True:
+        if sys.argv[1] == '-workers':
+            workers = int(sys.argv[2])
+            sys.argv.pop(1)
+        else:
+            break
+        sys.argv.pop(1)
+
+    # params
+    maindir = sys.argv[1]
+    fields = sys.argv[2:]
+    if len(fields) == 0:
+        fields = None
+
+    # sanity checks
+    if not os.path.isdir(maindir):
+        print 'ERROR: directory',maindir,'does not exists.'
+        sys.exit(0)
+
+    # go!
+    t1 = time.time()
+    cnt = 0
+    for h5filename,songidx,song in iter_songs(maindir,fields=fields,workers=workers):
+        cnt += 1
+    stimelength = str(datetime.timedelta(seconds=time.time()-t1))
+    print 'read',cnt,'songs in:',stimelength
@@ -0,0 +1,221 @@
+"""
+Thierry Bertin-Mahieux (2011) Columbia University
+tb2332@columbia.edu
+
+Tests of the aggregate file creation (hdf5_utils, create_aggregate_file)
+and of what reads them. Small fake song files are created in a
+temporary directory.
+To run them, from this directory:
+   python -m unittest test_aggregate
+
+This is part of the Million Song Dataset project from
+LabROSA (Columbia University) and The Echo Nest.
+
+
+Copyright 2011, Thierry Bertin-Mahieux
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import hdf5_utils as HDF5
+import hdf5_getters as GETTERS
+import hdf5_to_columns
+import create_aggregate_file
+
+
+def make_song_file(h5filename,seed):
+    """
+    Create a fake song file, random content from the seed,
+    songs with the same seed % 5 have the same artist
+    RETURN
+       track id
+    """
+    rnd = np.random.RandomState(seed)
+    HDF5.create_song_file(h5filename,force=True)
+    h5 = HDF5.open_h5_file_append(h5filename)
+    try:
+        artist = seed % 5
+        metadata = h5.root.metadata
+        metadata.songs.cols.artist_id[0] = 'AR%016d' % artist
+        metadata.songs.cols.artist_name[0] = 'artist %d' % artist
+        metadata.songs.cols.artist_familiarity[0] = artist / 10.
+        metadata.songs.cols.title[0] = 'title %d' % seed
+        metadata.similar_artists.append(np.array(['AR%016d' % k for k in range(artist)],
+                                                 dtype='S20'))
+        metadata.artist_terms.append(np.array(['term%d' % (artist+k) for k in range(3)],
+                                              dtype='S256'))
+        metadata.artist_terms_freq.append(np.arange(3) / (artist+1.))
+        metadata.artist_terms_weight.append(np.arange(3) / (artist+2.))
+        analysis = h5.root.analysis
+        track_id = 'TR%016d' % seed
+        analysis.songs.cols.track_id[0] = track_id
+        analysis.songs.cols.tempo[0] = 60. + seed
+        duration = 100. + seed
+        analysis.songs.cols.duration[0] = duration
+        nsegs = rnd.randint(20,40)
+        segstarts = np.sort(rnd.rand(nsegs)) * duration
+        segstarts[0] = 0.
+        analysis.segments_start.append(segstarts)
+        analysis.segments_confidence.append(rnd.rand(nsegs))
+        analysis.segments_pitches.append(rnd.rand(nsegs,12))
+        analysis.segments_timbre.append(rnd.randn(nsegs,12) * 50)
+        analysis.segments_loudness_max.append(-rnd.rand(nsegs) * 30)
+        analysis.segments_loudness_max_time.append(rnd.rand(nsegs))
+        analysis.segments_loudness_start.append(-rnd.rand(nsegs) * 30)
+        for name in ('sections','beats','bars','tatums'):
+            nrows = rnd.randint(5,20)
+            getattr(analysis,name+'_start').append(np.sort(rnd.rand(nrows)) * duration)
+            getattr(analysis,name+'_confidence').append(rnd.rand(nrows))
+        h5.root.musicbrainz.songs.cols.year[0] = 1990 + seed
+        h5.root.musicbrainz.artist_mbtags.append(np.array(['rock'],dtype='S256'))
+        h5.root.musicbrainz.artist_mbtags_count.append(np.array([seed],dtype='int32'))
+    finally:
+        h5.close()
+    return track_id
+
+
+class AggregateTest(unittest.TestCase):
+
+    def setUp(self):
+        """ a few song files in a temporary directory """
+        self.tmpdir = tempfile.mkdtemp()
+        self.h5filenames = []
+        for seed in range(12):
+            h5filename = os.path.join(self.tmpdir,'song%d.h5' % seed)
+            make_song_file(h5filename,seed)
+            self.h5filenames.append(h5filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_aggregate(self,name,h5filenames,**kwargs):
+        """ create and fill an aggregate file, return its filename """
+        aggfile = os.path.join(self.tmpdir,name)
+        HDF5.create_aggregate_file(aggfile,expectedrows=len(h5filenames),**kwargs)
+        h5 = HDF5.open_h5_file_append(aggfile)
+        try:
+            HDF5.fill_hdf5_aggregate_file(h5,h5filenames)
+        finally:
+            h5.close()
+        return aggfile
+
+    def test_artist_table_with_fields(self):
+        """ artists table with a projection that does not ask for artist_id """
+        aggfile = self.create_aggregate('agg.h5',self.h5filenames,artist_table=True,
+                                        fields=['tempo','artist_terms'])
+        h5 = GETTERS.open_h5_file_read(aggfile)
+        try:
+            self.assertTrue('artist_id' in h5.root.metadata.artists.colnames)
+            self.assertEqual(h5.root.metadata.artists.nrows,5)
+            for songidx,h5filename in enumerate(self.h5filenames):
+                song = GETTERS.open_h5_file_read(h5filename)
+                try:
+                    self.assertEqual(GETTERS.get_tempo(h5,songidx),GETTERS.get_tempo(song))
+                    self.assertEqual(GETTERS.get_artist_id(h5,songidx),
+                                     GETTERS.get_artist_id(song))
+                    self.assertEqual(list(GETTERS.get_artist_terms(h5,songidx)),
+                                     list(GETTERS.get_artist_terms(song)))
+                finally:
+                    song.close()
+        finally:
+            h5.close()
+
+    def test_columns_mixed_precision(self):
+        """ column export of a reduced precision aggregate and song files """
+        aggfile = self.create_aggregate('agg32.h5',self.h5filenames[:6],
+                                        precision='float32',pitches_precision='uint8')
+        outdir = os.path.join(self.tmpdir,'columns')
+        fields = ['track_id','segments_start','segments_pitches','segments_timbre']
+        nsongs = hdf5_to_columns.transfer([aggfile]+self.h5filenames[6:],outdir,fields=fields)
+        self.assertEqual(nsongs,12)
+        cs = hdf5_to_columns.ColumnStore(outdir)
+        self.assertEqual(cs.arrays['segments_timbre'].dtype,np.float32)
+        self.assertEqual(cs.arrays['segments_pitches'].dtype,np.float32)
+        for songidx,h5filename in enumerate(self.h5filenames):
+            song = GETTERS.open_h5_file_read(h5filename)
+            try:
+                self.assertEqual(cs.get_value('track_id',songidx),GETTERS.get_track_id(song))
+                for field,tol in (('segments_start',1e-3),('segments_pitches',1e-2),
+                                  ('segments_timbre',1e-3)):
+                    expected = GETTERS.__dict__['get_'+field](song)
+                    self.assertEqual(cs.get_array(field,songidx).shape,expected.shape)
+                    self.assertTrue(np.abs(cs.get_array(field,songidx) - expected).max() < tol)
+            finally:
+                song.close()
+
+    def test_bad_precision(self):
+        """ unsupported precisions are refused, no file is left open """
+        aggfile = os.path.join(self.tmpdir,'bad.h5')
+        for precision,pitches_precision in (('uint8',None),('int16',None),
+                                            ('float32','int16')):
+            self.assertRaises(ValueError,HDF5.create_aggregate_file,aggfile,force=True,
+                              precision=precision,pitches_precision=pitches_precision)
+        aggfile = self.create_aggregate('agg16.h5',self.h5filenames[:2],
+                                        precision='float16',pitches_precision='uint8')
+        h5 = GETTERS.open_h5_file_read(aggfile)
+        try:
+            self.assertEqual(h5.root.analysis.segments_timbre.dtype,np.float16)
+            self.assertEqual(GETTERS.get_segments_timbre(h5,1).dtype,np.float16)
+        finally:
+            h5.close()
+
+    def create_shard(self,name,h5filenames,batchsize):
+        """ create an uncompressed shard, filled batchsize songs at a time """
+        shardfile = os.path.join(self.tmpdir,name)
+        HDF5.create_aggregate_file(shardfile,expectedrows=len(h5filenames),complevel=0)
+        h5 = HDF5.open_h5_file_append(shardfile)
+        try:
+            HDF5.fill_hdf5_aggregate_file(h5,h5filenames,batchsize=batchsize)
+        finally:
+            h5.close()
+        return shardfile
+
+    def test_merge_shards_batch_sizes(self):
+        """ merge shards written with different batch sizes """
+        shards = [self.create_shard('shard0.h5',self.h5filenames[:5],batchsize=2),
+                  self.create_shard('shard1.h5',self.h5filenames[5:8],batchsize=1),
+                  self.create_shard('shard2.h5',self.h5filenames[8:],batchsize=100)]
+        # the output already has a song, shards do not start at 0
+        aggfile = self.create_aggregate('agg.h5',self.h5filenames[-1:])
+        h5 = HDF5.open_h5_file_append(aggfile)
+        try:
+            create_aggregate_file.merge_shards(h5,shards)
+        finally:
+            h5.close()
+        h5 = GETTERS.open_h5_file_read(aggfile)
+        try:
+            self.assertEqual(GETTERS.get_num_songs(h5),13)
+            for songidx,h5filename in enumerate(self.h5filenames[-1:]+self.h5filenames):
+                song = GETTERS.open_h5_file_read(h5filename)
+                try:
+                    expected = GETTERS.read_song(song)
+                    res = GETTERS.read_song(h5,songidx)
+                    for field in expected.keys():
+                        if field[:4] == 'idx_':
+                            continue
+                        self.assertTrue(np.all(res[field] == expected[field]),field)
+                finally:
+                    song.close()
+        finally:
+            h5.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,22 @@
 import os
 import glob
 
-def get_all_files(basedir,ext='.h5') :
+def get_all_files(basedir,ext='.h5',manifest=None) :
     """
     From a root directory, go through all subdirectories
     and find all files with the given extension.
     Return all absolute paths in a list.
+    If manifest is a manifest file (see file_manifest.py), it is
+    refreshed and the paths are read from it instead (sorted).
     """
+    if manifest is not None:
+        import file_manifest
+        conn = file_manifest.open_manifest(manifest)
+        try:
+            file_manifest.refresh_manifest(conn,basedir,ext=ext)
+            return file_manifest.get_manifest_files(conn,basedir)
+        finally:
+            conn.close()
     allfiles = []
     for root, dirs, files in os.walk(basedir):
         files = glob.glob(os.path.join(root,'*'+ext))
@@ -165,6 +165,8 @@ def get_time_warp_matrix(segstart, btstart, duration):
     Returns a matrix (#beats,#segs)
     #segs should be larger than #beats, i.e. many events or segs
     happen in one beat.
+    Beats are located among the segments with np.searchsorted,
+    all beats at once, no loop (same matrix as the original loop).
     THIS FUNCTION WAS ORIGINALLY CREATED BY RON J. WEISS (Columbia/NYU/Google)
     """
     # length of beats and segments in seconds
@@ -176,40 +178,39 @@ def get_time_warp_matrix(segstart, btstart, duration):
     btlen = np.concatenate((btstart[1:], [duration])) - btstart
 
     warpmat = np.zeros((len(segstart), len(btstart)))
-    # iterate over beats (columns of warpmat)
-    for n in xrange(len(btstart)):
-        # beat start time and end time in seconds
-        start = btstart[n]
-        end = start + btlen[n]
-        # np.nonzero returns index of nonzero elems
-        # find first segment that starts after beat starts - 1
-        try:
-            start_idx = np.nonzero((segstart - start) >= 0)[0][0] - 1
-        except IndexError:
-            # no segment start after that beats, can happen close
-            # to the end, simply ignore, maybe even break?
-            # (catching faster than ckecking... it happens rarely?)
-            break
-        # find first segment that starts after beat ends
-        segs_after = np.nonzero((segstart - end) >= 0)[0]
-        if segs_after.shape[0] == 0:
-            end_idx = start_idx
-        else:
-            end_idx = segs_after[0]
-        # fill col of warpmat with 1 for the elem in between
-        # (including start_idx, excluding end_idx)
-        warpmat[start_idx:end_idx, n] = 1.
-        # if the beat started after the segment, keep the proportion
-        # of the segment that is inside the beat
-        warpmat[start_idx, n] = 1. - ((start - segstart[start_idx])
-                                 / seglen[start_idx])
-        # if the segment ended after the beat ended, keep the proportion
-        # of the segment that is inside the beat
-        if end_idx - 1 > start_idx:
-            warpmat[end_idx-1, n] = ((end - segstart[end_idx-1])
-                                     / seglen[end_idx-1])
-        # normalize so the 'energy' for one beat is one
-        warpmat[:, n] /= np.sum(warpmat[:, n])
+    # for each beat, first segment that starts after beat starts - 1
+    start_idx = np.searchsorted(segstart, btstart, side='left') - 1
+    # no segment start after a beat, can happen close to the end,
+    # we ignore that beat and the next ones
+    nosegs = np.nonzero(start_idx == len(segstart) - 1)[0]
+    if nosegs.shape[0] > 0:
+        start_idx = start_idx[:nosegs[0]]
+    nbeats = start_idx.shape[0]
+    beats = np.arange(nbeats)
+    # beat start time and end time in seconds
+    start = btstart[:nbeats]
+    end = start + btlen[:nbeats]
+    # first segment that starts after beat ends
+    end_idx = np.searchsorted(segstart, end, side='left')
+    end_idx[end_idx == len(segstart)] = start_idx[end_idx == len(segstart)]
+    # fill warpmat with 1 for the segs in between
+    # (excluding start_idx and end_idx-1, set below)
+    nmiddle = np.maximum(end_idx - start_idx - 2, 0)
+    nmiddle[start_idx < 0] = 0
+    offsets = np.arange(nmiddle.sum()) - np.repeat(np.cumsum(nmiddle) - nmiddle, nmiddle)
+    warpmat[np.repeat(start_idx + 1, nmiddle) + offsets, np.repeat(beats, nmiddle)] = 1.
+    # if the beat started after the segment, keep the proportion
+    # of the segment that is inside the beat
+    warpmat[start_idx, beats] = 1. - ((start - segstart[start_idx])
+                                      / seglen[start_idx])
+    # if the segment ended after the beat ended, keep the proportion
+    # of the segment that is inside the beat
+    ended = end_idx - 1 > start_idx
+    last_idx = end_idx[ended] - 1
+    warpmat[last_idx, beats[ended]] = ((end[ended] - segstart[last_idx])
+                                       / seglen[last_idx])
+    # normalize so the 'energy' for one beat is one
+    warpmat[:, :nbeats] /= np.sum(warpmat[:, :nbeats], axis=0)
     # return the transpose, meaning (#beats , #segs)
     return warpmat.T
 